@@ -3,16 +3,143 @@ AI Service Integration
 Claude, Mistral, and Grok APIs for tweet remixing
 """
 
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from mistralai import Mistral
-from openai import OpenAI
-from typing import Dict, List
+from openai import AsyncOpenAI
+from typing import AsyncIterator, Dict, List, Optional, Union
+import asyncio
 import json
 import logging
 from app.database import settings
+from app.llm_cache import llm_cache, cached_llm
 
 logger = logging.getLogger(__name__)
 
+_json_decoder = json.JSONDecoder()
+
+# Remix output cap: ~280 chars at ~3.5 chars/token, plus a little headroom.
+# _trim_tweet still enforces TWEET_MAX_CHARS as a safety net.
+REMIX_MAX_TOKENS = 90
+REMIX_STOP_SEQUENCES = ["\n\n"]
+
+TWEET_MAX_CHARS = 280
+
+
+def _trim_tweet(text: str) -> str:
+    """Strip model output and cut it to TWEET_MAX_CHARS with an ellipsis"""
+    text = text.strip()
+    if len(text) > TWEET_MAX_CHARS:
+        text = text[:TWEET_MAX_CHARS - 3] + "..."
+    return text
+
+
+async def _read_tweet(text_chunks: AsyncIterator[str]) -> str:
+    """
+    Consume streamed model output until it no longer fits in a tweet
+
+    Args:
+        text_chunks: Streamed text deltas
+
+    Returns:
+        Remixed tweet, at most 280 characters
+    """
+    remixed_text = ""
+    async for chunk in text_chunks:
+        remixed_text += chunk
+        if len(remixed_text) > TWEET_MAX_CHARS:
+            # Anything further would be truncated anyway
+            break
+
+    return _trim_tweet(remixed_text)
+
+
+# Input token budget for the voice-analysis tweet sample
+VOICE_SAMPLE_TOKEN_BUDGET = 6000
+
+# Rough English average for Claude's tokenizer; good enough for budgeting
+_CHARS_PER_TOKEN = 4
+
+
+def _sample_by_token_budget(tweets: List[str], budget: int) -> List[str]:
+    """
+    Take tweets in order until the estimated token budget is used up
+
+    Args:
+        tweets: Tweets, most relevant first
+        budget: Max estimated input tokens
+
+    Returns:
+        Leading slice of tweets that fits the budget
+    """
+    used = 0
+    for i, tweet in enumerate(tweets):
+        # +2 for the "- " bullet and newline around each tweet
+        used += len(tweet) // _CHARS_PER_TOKEN + 2
+        if used > budget:
+            return tweets[:i]
+    return tweets
+
+
+# Prompt templates, built once at import
+ANALYZE_VOICE_PROMPT_HEAD = """Analyze these tweets and identify the author's niche, voice, and content strategy.
+
+Tweets:
+- """
+
+ANALYZE_VOICE_PROMPT_TAIL = """
+
+Return a JSON object with this exact structure:
+{
+  "niche": ["primary niche", "secondary niche"],
+  "tone": "description of tone (e.g., technical, casual, motivational)",
+  "topics": ["common topic 1", "common topic 2", "common topic 3"],
+  "best_content": ["content type 1", "content type 2"]
+}
+
+Focus on:
+1. What topics/industries they discuss
+2. Their writing tone and style
+3. Most common themes
+4. Best performing content types"""
+
+REMIX_PROMPT_TEMPLATE = """Remix this viral tweet in the following writing style:
+
+Original Tweet: {original}
+
+Target Voice Profile:
+- Niche: {niche}
+- Tone: {tone}
+- Style: {style}
+
+Requirements:
+1. Keep the core message/value
+2. Match the target voice perfectly
+3. Max 280 characters
+4. Make it authentic, not robotic
+
+Return ONLY the remixed tweet text."""
+
+
+def _extract_json_object(text: str) -> Dict:
+    """
+    Decode the first JSON object in a model response
+
+    Args:
+        text: Raw response text (may include code fences or prose)
+
+    Returns:
+        Parsed object
+
+    Raises:
+        ValueError: If no JSON object is found
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object in response")
+
+    obj, _ = _json_decoder.raw_decode(text, start)
+    return obj
+
 
 class AIRemixer:
     """
@@ -22,15 +149,15 @@ class AIRemixer:
 
     def __init__(self):
         # Initialize AI clients
-        self.claude = Anthropic(api_key=settings.anthropic_api_key)
+        self.claude = AsyncAnthropic(api_key=settings.anthropic_api_key)
         self.mistral = Mistral(api_key=settings.mistral_api_key) if settings.mistral_api_key else None
-        self.grok = OpenAI(
+        self.grok = AsyncOpenAI(
             api_key=settings.grok_api_key or settings.xai_api_key,
             base_url=settings.grok_base_url
         ) if (settings.grok_api_key or settings.xai_api_key) else None
 
 
-    def analyze_voice(self, tweets: List[str]) -> Dict:
+    async def analyze_voice(self, tweets: List[str]) -> Dict:
         """
         Analyze user's writing style and detect niche
 
@@ -45,30 +172,19 @@ class AIRemixer:
                 "best_content": ["threads", "hot takes"]
             }
         """
-        # Truncate tweets if too many (to fit in context)
-        sample_tweets = tweets[:50] if len(tweets) > 50 else tweets
-
-        prompt = f"""Analyze these tweets and identify the author's niche, voice, and content strategy.
-
-Tweets:
-{chr(10).join(f'- {t}' for t in sample_tweets)}
+        # Truncate by estimated prompt size rather than tweet count
+        sample_tweets = _sample_by_token_budget(tweets, VOICE_SAMPLE_TOKEN_BUDGET)
 
-Return a JSON object with this exact structure:
-{{
-  "niche": ["primary niche", "secondary niche"],
-  "tone": "description of tone (e.g., technical, casual, motivational)",
-  "topics": ["common topic 1", "common topic 2", "common topic 3"],
-  "best_content": ["content type 1", "content type 2"]
-}}
+        # Same tweet sample -> same profile, regardless of order
+        cache_key = llm_cache.make_key("claude:analyze_voice", "\n".join(sorted(sample_tweets)))
+        cached_profile = await llm_cache.get(cache_key)
+        if cached_profile is not None:
+            return cached_profile
 
-Focus on:
-1. What topics/industries they discuss
-2. Their writing tone and style
-3. Most common themes
-4. Best performing content types"""
+        prompt = ANALYZE_VOICE_PROMPT_HEAD + "\n- ".join(sample_tweets) + ANALYZE_VOICE_PROMPT_TAIL
 
         try:
-            message = self.claude.messages.create(
+            message = await self.claude.messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=1024,
                 messages=[
@@ -77,19 +193,13 @@ Focus on:
             )
 
             # Extract JSON from response
-            response_text = message.content[0].text.strip()
-
-            # Try to parse JSON
-            # Sometimes Claude wraps JSON in markdown code blocks
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-
-            voice_profile = json.loads(response_text)
+            # Sometimes Claude wraps JSON in markdown code blocks or adds prose around it
+            voice_profile = _extract_json_object(message.content[0].text)
 
             logger.info(f"Voice analysis complete: {voice_profile}")
 
+            await llm_cache.set(cache_key, voice_profile, ttl=86400)
+
             return voice_profile
 
         except Exception as e:
@@ -103,7 +213,28 @@ Focus on:
             }
 
 
-    def remix_tweet(
+    def build_remix_prompt(self, original_content: str, voice_profile: Dict) -> str:
+        """
+        Build the remix prompt for a viral tweet
+
+        Args:
+            original_content: Original viral tweet
+            voice_profile: User's voice characteristics from analyze_voice()
+
+        Returns:
+            Prompt text
+        """
+        voice_characteristics = voice_profile.get('voice_characteristics', {})
+
+        return REMIX_PROMPT_TEMPLATE.format(
+            original=original_content,
+            niche=voice_profile.get('niche'),
+            tone=voice_characteristics.get('tone'),
+            style=voice_characteristics.get('style')
+        )
+
+
+    async def remix_tweet(
         self,
         original_content: str,
         voice_profile: Dict,
@@ -120,100 +251,201 @@ Focus on:
         Returns:
             Remixed tweet content
         """
-        prompt = f"""
-        Remix this viral tweet in the following writing style:
-
-        Original Tweet: {original_content}
-
-        Target Voice Profile:
-        - Niche: {voice_profile.get('niche')}
-        - Tone: {voice_profile.get('voice_characteristics', {}).get('tone')}
-        - Style: {voice_profile.get('voice_characteristics', {}).get('style')}
-
-        Requirements:
-        1. Keep the core message/value
-        2. Match the target voice perfectly
-        3. Max 280 characters
-        4. Make it authentic, not robotic
-
-        Return ONLY the remixed tweet text.
-        """
+        prompt = self.build_remix_prompt(original_content, voice_profile)
 
         if model == "claude":
-            return self._remix_with_claude(prompt)
+            return await self._remix_with_claude(prompt)
         elif model == "mistral":
-            return self._remix_with_mistral(prompt)
+            return await self._remix_with_mistral(prompt)
         elif model == "grok":
-            return self._remix_with_grok(prompt)
+            return await self._remix_with_grok(prompt)
         else:
             raise ValueError(f"Unknown AI model: {model}")
 
 
-    def _remix_with_claude(self, prompt: str) -> str:
+    async def remix_many(
+        self,
+        originals: List[str],
+        voice_profile: Dict,
+        model: str = "claude",
+        max_concurrency: Optional[int] = None
+    ) -> List[Union[str, Exception]]:
+        """
+        Remix several viral tweets concurrently
+
+        Args:
+            originals: Original viral tweets
+            voice_profile: User's voice characteristics from analyze_voice()
+            model: AI model to use (claude, mistral, grok)
+            max_concurrency: Cap on in-flight provider requests (None = unbounded)
+
+        Returns:
+            Remixed tweets in input order; failed remixes are returned
+            as the raised exception instead of aborting the whole batch
+        """
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        async def _one(original: str) -> str:
+            if semaphore is None:
+                return await self.remix_tweet(original, voice_profile, model)
+            async with semaphore:
+                return await self.remix_tweet(original, voice_profile, model)
+
+        return await asyncio.gather(
+            *(_one(original) for original in originals),
+            return_exceptions=True
+        )
+
+
+    async def submit_batch(self, prompts: Dict[str, str]) -> str:
+        """
+        Submit remix prompts to the Claude Message Batches API
+
+        Batches are billed at half the real-time price and are processed
+        asynchronously, so only use this for non-user-facing work.
+
+        Args:
+            prompts: {custom_id: prompt}
+
+        Returns:
+            Batch ID to poll with get_batch_results()
+        """
+        batch = await self.claude.beta.messages.batches.create(
+            requests=[
+                {
+                    "custom_id": custom_id,
+                    "params": {
+                        "model": "claude-sonnet-4-20250514",
+                        "max_tokens": REMIX_MAX_TOKENS,
+                        "stop_sequences": REMIX_STOP_SEQUENCES,
+                        "messages": [
+                            {"role": "user", "content": prompt}
+                        ]
+                    }
+                }
+                for custom_id, prompt in prompts.items()
+            ]
+        )
+
+        logger.info(f"Submitted Claude batch {batch.id} with {len(prompts)} requests")
+
+        return batch.id
+
+
+    async def get_batch_results(self, batch_id: str) -> Optional[Dict[str, str]]:
+        """
+        Fetch results of a Claude message batch
+
+        Args:
+            batch_id: ID returned by submit_batch()
+
+        Returns:
+            {custom_id: remixed_text} for succeeded requests,
+            or None while the batch is still processing
+        """
+        batch = await self.claude.beta.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return None
+
+        results = {}
+        async for entry in await self.claude.beta.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                logger.error(f"Batch {batch_id} request {entry.custom_id} {entry.result.type}")
+                continue
+
+            results[entry.custom_id] = _trim_tweet(entry.result.message.content[0].text)
+
+        return results
+
+
+    @cached_llm("claude", ttl=3600)
+    async def _remix_with_claude(self, prompt: str) -> str:
         """Use Claude for remixing"""
         try:
-            message = self.claude.messages.create(
+            async with self.claude.messages.stream(
                 model="claude-sonnet-4-20250514",
-                max_tokens=300,
+                max_tokens=REMIX_MAX_TOKENS,
+                stop_sequences=REMIX_STOP_SEQUENCES,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
-            )
-
-            remixed_text = message.content[0].text.strip()
-
-            # Ensure it's under 280 characters
-            if len(remixed_text) > 280:
-                remixed_text = remixed_text[:277] + "..."
-
-            return remixed_text
+            ) as stream:
+                # Leaving the block closes the stream, cancelling any remaining generation
+                return await _read_tweet(stream.text_stream)
 
         except Exception as e:
             logger.error(f"Error remixing with Claude: {e}")
             raise
 
 
-    def _remix_with_mistral(self, prompt: str) -> str:
+    @cached_llm("mistral", ttl=3600)
+    async def _remix_with_mistral(self, prompt: str) -> str:
         """Use Mistral for remixing"""
         try:
-            response = self.mistral.chat.complete(
+            response = await self.mistral.chat.stream_async(
                 model="mistral-small-latest",
+                max_tokens=REMIX_MAX_TOKENS,
+                stop=REMIX_STOP_SEQUENCES,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
             )
 
-            remixed_text = response.choices[0].message.content.strip()
-
-            # Ensure it's under 280 characters
-            if len(remixed_text) > 280:
-                remixed_text = remixed_text[:277] + "..."
-
-            return remixed_text
+            async with response as events:
+                return await _read_tweet(
+                    event.data.choices[0].delta.content or ""
+                    async for event in events
+                    if event.data.choices
+                )
 
         except Exception as e:
             logger.error(f"Error remixing with Mistral: {e}")
             raise
 
 
-    def _remix_with_grok(self, prompt: str) -> str:
+    @cached_llm("grok", ttl=3600)
+    async def _remix_with_grok(self, prompt: str) -> str:
         """Use Grok for remixing"""
         try:
-            response = self.grok.chat.completions.create(
+            stream = await self.grok.chat.completions.create(
                 model="grok-beta",
+                max_tokens=REMIX_MAX_TOKENS,
+                stop=REMIX_STOP_SEQUENCES,
+                stream=True,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
             )
 
-            remixed_text = response.choices[0].message.content.strip()
-
-            # Ensure it's under 280 characters
-            if len(remixed_text) > 280:
-                remixed_text = remixed_text[:277] + "..."
-
-            return remixed_text
+            try:
+                return await _read_tweet(
+                    chunk.choices[0].delta.content or ""
+                    async for chunk in stream
+                    if chunk.choices
+                )
+            finally:
+                await stream.close()
 
         except Exception as e:
             logger.error(f"Error remixing with Grok: {e}")
             raise
+
+
+# Process-wide instance; created lazily so importing this module stays cheap
+_remixer: Optional[AIRemixer] = None
+
+
+def get_remixer() -> AIRemixer:
+    """
+    Get the shared AIRemixer, creating it on first use
+
+    Reusing one instance keeps the SDK clients' connection pools warm
+    across requests and tasks.
+
+    Returns:
+        AIRemixer instance
+    """
+    global _remixer
+    if _remixer is None:
+        _remixer = AIRemixer()
+    return _remixer
@@ -5,21 +5,39 @@ JWT token creation and X OAuth 2.0 flow
 
 from datetime import datetime, timedelta
 from typing import Optional, Dict
-from jose import JWTError, jwt
 from passlib.context import CryptContext
+from cryptography.exceptions import InvalidTag
 import httpx
+import jwt
+import os
 import secrets
 import hashlib
 import base64
+import time
 from urllib.parse import urlencode
 from app.database import settings
+from app.encryption import token_encryption
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# HMAC key bytes for JWT signing, encoded once at import
+_JWT_KEY = settings.jwt_secret_key.encode()
+
+# Password hashing (argon2id; existing bcrypt hashes still verify and are flagged for rehash)
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    deprecated="auto",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
+    """
+    Verify a password against its hash
+
+    CPU-bound; call via asyncio.to_thread() from async route handlers
+    """
     return pwd_context.verify(plain_password, hashed_password)
 
 
@@ -34,13 +52,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     to_encode = data.copy()
 
+    # RFC 7519 "sub" is a string; PyJWT rejects other types on decode
+    if "sub" in to_encode:
+        to_encode["sub"] = str(to_encode["sub"])
+
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.jwt_expiration_minutes)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    encoded_jwt = jwt.encode(to_encode, _JWT_KEY, algorithm=settings.jwt_algorithm)
 
     return encoded_jwt
 
@@ -50,9 +72,9 @@ def verify_token(token: str) -> Optional[dict]:
     Verify and decode a JWT token
     """
     try:
-        payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
+        payload = jwt.decode(token, _JWT_KEY, algorithms=[settings.jwt_algorithm])
         return payload
-    except JWTError:
+    except jwt.PyJWTError:
         return None
 
 
@@ -61,6 +83,23 @@ X_OAUTH_AUTHORIZE_URL = "https://twitter.com/i/oauth2/authorize"
 X_OAUTH_TOKEN_URL = "https://api.twitter.com/2/oauth2/token"
 X_OAUTH_REVOKE_URL = "https://api.twitter.com/2/oauth2/revoke"
 
+# Shared client for X OAuth calls (keeps TLS connections alive between requests)
+_x_http = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    timeout=10.0,
+    http2=True
+)
+
+# OAuth state lifetime (seconds) and AES-GCM parameters; the associated data keeps
+# sealed states from being interchangeable with encrypted stored tokens
+OAUTH_STATE_TTL = 600
+_STATE_NONCE_SIZE = 12
+_STATE_AAD = b"prism:oauth_state"
+
+# HttpOnly cookie set when the flow starts; only the browser holding it can
+# collect the login result from /api/auth/status
+OAUTH_BROWSER_COOKIE = "prism_oauth_browser"
+
 # Required OAuth scopes
 X_OAUTH_SCOPES = [
     "tweet.read",
@@ -78,29 +117,90 @@ def generate_pkce_pair() -> tuple[str, str]:
     Returns:
         (code_verifier, code_challenge)
     """
-    # Generate code_verifier (43-128 chars)
-    code_verifier = base64.urlsafe_b64encode(secrets.token_bytes(32)).decode('utf-8')
-    code_verifier = code_verifier.rstrip('=')  # Remove padding
+    # Generate code_verifier (43 chars, URL-safe base64 without padding)
+    code_verifier = secrets.token_urlsafe(32)
 
-    # Generate code_challenge using SHA256
-    challenge_bytes = hashlib.sha256(code_verifier.encode('utf-8')).digest()
-    code_challenge = base64.urlsafe_b64encode(challenge_bytes).decode('utf-8')
-    code_challenge = code_challenge.rstrip('=')  # Remove padding
+    # Generate code_challenge using SHA256 (strip padding before decoding)
+    challenge_bytes = hashlib.sha256(code_verifier.encode('ascii')).digest()
+    code_challenge = base64.urlsafe_b64encode(challenge_bytes).rstrip(b'=').decode('ascii')
 
     return code_verifier, code_challenge
 
 
-def get_x_oauth_url(state: str) -> tuple[str, str]:
+def create_oauth_state(code_verifier: str) -> str:
     """
-    Generate X OAuth 2.0 authorization URL with PKCE
+    Seal a PKCE code_verifier and expiry into a self-contained OAuth state
+
+    AES-GCM authenticates the state (CSRF protection) and keeps the verifier
+    hidden from anyone who sees the redirect URL, so no server-side storage
+    is needed.
+
+    Args:
+        code_verifier: PKCE code_verifier
+
+    Returns:
+        URL-safe state string
+    """
+    nonce = os.urandom(_STATE_NONCE_SIZE)
+    payload = f"{int(time.time()) + OAUTH_STATE_TTL}:{code_verifier}".encode()
+    sealed = token_encryption.cipher.encrypt(nonce, payload, _STATE_AAD)
+    return base64.urlsafe_b64encode(nonce + sealed).rstrip(b"=").decode("ascii")
+
+
+def verify_oauth_state(state: str) -> Optional[str]:
+    """
+    Verify an OAuth state from create_oauth_state()
+
+    Args:
+        state: State parameter returned by X
+
+    Returns:
+        The code_verifier, or None if the state is forged, corrupted or expired
+    """
+    try:
+        data = base64.urlsafe_b64decode(state + "=" * (-len(state) % 4))
+        payload = token_encryption.cipher.decrypt(
+            data[:_STATE_NONCE_SIZE], data[_STATE_NONCE_SIZE:], _STATE_AAD
+        ).decode()
+        expires_at, code_verifier = payload.split(":", 1)
+        expires_at = int(expires_at)
+    except (InvalidTag, ValueError):
+        return None
+
+    if expires_at < time.time():
+        return None
+
+    return code_verifier
+
+
+def create_oauth_browser_nonce() -> str:
+    """Random value for the OAuth browser cookie"""
+    return secrets.token_urlsafe(32)
+
+
+def oauth_browser_key(browser_nonce: str) -> str:
+    """
+    Hash an OAuth browser cookie value for storage alongside the login result
 
     Args:
-        state: Random state string for CSRF protection
+        browser_nonce: Value of the OAUTH_BROWSER_COOKIE cookie
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    return hashlib.sha256(browser_nonce.encode()).hexdigest()
+
+
+def get_x_oauth_url() -> tuple[str, str]:
+    """
+    Generate X OAuth 2.0 authorization URL with PKCE
 
     Returns:
-        (authorization_url, code_verifier) - Store code_verifier in session/redis for callback
+        (authorization_url, state) - the state carries the sealed code_verifier
+        for the callback
     """
     code_verifier, code_challenge = generate_pkce_pair()
+    state = create_oauth_state(code_verifier)
 
     # Use x_oauth_callback_url if set, otherwise use x_redirect_uri
     redirect_uri = settings.x_oauth_callback_url or settings.x_redirect_uri
@@ -117,7 +217,12 @@ def get_x_oauth_url(state: str) -> tuple[str, str]:
 
     authorization_url = f"{X_OAUTH_AUTHORIZE_URL}?{urlencode(params)}"
 
-    return authorization_url, code_verifier
+    return authorization_url, state
+
+
+async def close_x_http() -> None:
+    """Close the shared X OAuth HTTP client (call on app shutdown)"""
+    await _x_http.aclose()
 
 
 async def exchange_code_for_token(code: str, code_verifier: str) -> Dict:
@@ -142,21 +247,20 @@ async def exchange_code_for_token(code: str, code_verifier: str) -> Dict:
     # Use x_oauth_callback_url if set, otherwise use x_redirect_uri
     redirect_uri = settings.x_oauth_callback_url or settings.x_redirect_uri
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            X_OAUTH_TOKEN_URL,
-            data={
-                "code": code,
-                "grant_type": "authorization_code",
-                "client_id": settings.x_client_id,
-                "redirect_uri": redirect_uri,
-                "code_verifier": code_verifier
-            },
-            auth=(settings.x_client_id, settings.x_client_secret),
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await _x_http.post(
+        X_OAUTH_TOKEN_URL,
+        data={
+            "code": code,
+            "grant_type": "authorization_code",
+            "client_id": settings.x_client_id,
+            "redirect_uri": redirect_uri,
+            "code_verifier": code_verifier
+        },
+        auth=(settings.x_client_id, settings.x_client_secret),
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    response.raise_for_status()
+    return response.json()
 
 
 async def refresh_x_token(refresh_token: str) -> Dict:
@@ -177,19 +281,18 @@ async def refresh_x_token(refresh_token: str) -> Dict:
     Raises:
         httpx.HTTPError: If refresh fails
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            X_OAUTH_TOKEN_URL,
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-                "client_id": settings.x_client_id
-            },
-            auth=(settings.x_client_id, settings.x_client_secret),
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        response.raise_for_status()
-        return response.json()
+    response = await _x_http.post(
+        X_OAUTH_TOKEN_URL,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": settings.x_client_id
+        },
+        auth=(settings.x_client_id, settings.x_client_secret),
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    response.raise_for_status()
+    return response.json()
 
 
 async def revoke_x_token(token: str, token_type: str = "access_token") -> bool:
@@ -203,15 +306,14 @@ async def revoke_x_token(token: str, token_type: str = "access_token") -> bool:
     Returns:
         True if successful
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            X_OAUTH_REVOKE_URL,
-            data={
-                "token": token,
-                "token_type_hint": token_type,
-                "client_id": settings.x_client_id
-            },
-            auth=(settings.x_client_id, settings.x_client_secret),
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        return response.status_code == 200
+    response = await _x_http.post(
+        X_OAUTH_REVOKE_URL,
+        data={
+            "token": token,
+            "token_type_hint": token_type,
+            "client_id": settings.x_client_id
+        },
+        auth=(settings.x_client_id, settings.x_client_secret),
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    return response.status_code == 200
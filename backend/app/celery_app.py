@@ -2,13 +2,33 @@
 Celery configuration and background tasks
 """
 
-from celery import Celery
+from celery import Celery, group
+from celery.signals import worker_process_init
+from kombu.serialization import register
 from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload
+import asyncio
 import logging
-from app.database import settings
+import orjson
+from app.database import settings, engine, SessionLocal
 
 logger = logging.getLogger(__name__)
 
+# orjson serializer for task payloads and results
+register(
+    "orjson",
+    orjson.dumps,
+    orjson.loads,
+    content_type="application/x-orjson",
+    content_encoding="binary"
+)
+
+# A dispatched post still not posted/failed after this is assumed lost and re-queued.
+# Well past task_time_limit plus a broker backlog, so live tasks aren't reclaimed
+DISPATCH_STALE_AFTER = timedelta(minutes=15)
+
 # Celery app
 celery_app = Celery(
     "prism",
@@ -17,16 +37,60 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    task_serializer="orjson",
+    accept_content=["orjson", "json"],
+    result_serializer="orjson",
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
-    task_time_limit=300,  # 5 minutes max per task
+    task_time_limit=300,  # 5 minutes max per task (see DISPATCH_STALE_AFTER)
+    result_expires=600,  # finalize_oauth results hold a JWT; drop them if never collected
+    worker_prefetch_multiplier=1,  # Don't let one worker hoard queued tweets
+    beat_schedule={
+        "process-scheduled-posts": {
+            "task": "prism.process_scheduled_posts",
+            "schedule": 30.0,
+        },
+    },
 )
 
 
+@worker_process_init.connect
+def _reset_db_pool(**kwargs):
+    """Drop DB connections inherited from the parent process after fork"""
+    engine.dispose(close=False)
+
+
+@worker_process_init.connect
+def _warm_ai_clients(**kwargs):
+    """Create the shared AI clients before the first task arrives"""
+    from app.ai_service import get_remixer
+
+    get_remixer()
+
+
+# Per-process event loop for async AI calls. The shared AIRemixer's clients pool
+# connections on the loop that opened them, so tasks reuse one loop rather than
+# creating a fresh one with asyncio.run() per task.
+_loop = None
+
+
+def run_async(coro):
+    """
+    Run a coroutine to completion on this worker's persistent event loop
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
 # Background Tasks
 @celery_app.task(name="prism.post_scheduled_tweet")
 def post_scheduled_tweet(scheduled_post_id: int):
@@ -39,23 +103,28 @@ def post_scheduled_tweet(scheduled_post_id: int):
     Returns:
         Tweet data with ID
     """
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    from app.models import User, ScheduledPost
+    from app.models import ScheduledPost
     from app.x_api import XAPIClient
-    from app.encryption import decrypt_token
-    from app.redis_client import check_x_post_rate_limit, increment_x_post_count
+    from app.encryption import get_access_token, encrypt_token, is_legacy_token
+    from app.redis_client import check_x_post_rate_limit
 
     logger.info(f"Attempting to post scheduled tweet {scheduled_post_id}")
 
-    # Database connection
-    engine = create_engine(settings.database_url)
-    Session = sessionmaker(bind=engine)
-    db = Session()
+    db = SessionLocal()
 
     try:
-        # 1. Fetch scheduled post from DB
-        scheduled_post = db.query(ScheduledPost).filter(ScheduledPost.id == scheduled_post_id).first()
+        # 1. Fetch scheduled post and its user in one round-trip (post row locked, so a
+        #    duplicate delivery waits and then sees "posted")
+        scheduled_post = (
+            db.execute(
+                select(ScheduledPost)
+                .options(joinedload(ScheduledPost.user))
+                .where(ScheduledPost.id == scheduled_post_id)
+                .with_for_update(of=ScheduledPost)
+            )
+            .scalars()
+            .first()
+        )
         if not scheduled_post:
             logger.error(f"Scheduled post {scheduled_post_id} not found")
             raise ValueError(f"Scheduled post {scheduled_post_id} not found")
@@ -66,26 +135,29 @@ def post_scheduled_tweet(scheduled_post_id: int):
             return {"status": "already_posted"}
 
         # 2. Get user and decrypt X access token
-        user = db.query(User).filter(User.id == scheduled_post.user_id).first()
+        user = scheduled_post.user
         if not user or not user.x_access_token:
             scheduled_post.status = "failed"
             scheduled_post.error_message = "User not found or no X access token"
             db.commit()
             raise ValueError(f"User {scheduled_post.user_id} not found or no token")
 
-        # 3. Check rate limit (100 posts per 15 minutes)
+        # 3. Check and reserve a slot in the rate limit (100 posts per 15 minutes)
         allowed, remaining, reset_in = check_x_post_rate_limit(user.id)
 
         if not allowed:
             logger.warning(f"Rate limit exceeded for user {user.id}. Retrying in {reset_in} seconds")
-            # Reschedule for after rate limit resets
+            # Reschedule for after rate limit resets; process_scheduled_posts picks it up again
             scheduled_post.scheduled_for = datetime.utcnow() + timedelta(seconds=reset_in + 60)
+            scheduled_post.status = "pending"
             db.commit()
-            # Retry task after rate limit reset
-            raise self.retry(countdown=reset_in + 60, max_retries=3)
+            return {"status": "rate_limited", "retry_in": reset_in + 60}
 
         # 4. Post tweet via X API
-        access_token = decrypt_token(user.x_access_token)
+        access_token = get_access_token(user)
+        if is_legacy_token(user.x_access_token):
+            # Re-encrypt Fernet-era tokens with AES-GCM; saved with the status update
+            user.x_access_token = encrypt_token(access_token)
         x_client = XAPIClient(access_token=access_token)
 
         try:
@@ -97,9 +169,6 @@ def post_scheduled_tweet(scheduled_post_id: int):
             scheduled_post.posted_at = datetime.utcnow()
             scheduled_post.error_message = None
 
-            # Increment rate limit counter
-            increment_x_post_count(user.id)
-
             db.commit()
 
             logger.info(f"Successfully posted tweet {tweet_data['id']} for user {user.id}")
@@ -150,23 +219,19 @@ def analyze_user_voice(user_id: int):
     Returns:
         Voice profile dict
     """
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
     from app.models import User
     from app.x_api import XAPIClient
-    from app.ai_service import AIRemixer
-    from app.encryption import decrypt_token
+    from app.ai_service import get_remixer
+    from app.encryption import get_access_token, encrypt_token, is_legacy_token
+    from app.redis_client import invalidate_cached_user
 
     logger.info(f"Starting voice analysis for user {user_id}")
 
-    # Database connection
-    engine = create_engine(settings.database_url)
-    Session = sessionmaker(bind=engine)
-    db = Session()
+    db = SessionLocal()
 
     try:
         # 1. Fetch user from database
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.get(User, user_id)
         if not user:
             logger.error(f"User {user_id} not found")
             raise ValueError(f"User {user_id} not found")
@@ -176,22 +241,22 @@ def analyze_user_voice(user_id: int):
             raise ValueError(f"User {user_id} has no X access token")
 
         # 2. Decrypt X access token
-        access_token = decrypt_token(user.x_access_token)
+        access_token = get_access_token(user)
+        if is_legacy_token(user.x_access_token):
+            # Re-encrypt Fernet-era tokens with AES-GCM; saved with the profile update
+            user.x_access_token = encrypt_token(access_token)
 
         # 3. Fetch user's recent tweets
         x_client = XAPIClient(access_token=access_token)
-        tweets = x_client.get_user_tweets(user_id=user.x_user_id, max_results=100)
+        tweet_texts = x_client.get_user_tweet_texts(user_id=user.x_user_id, max_results=100)
 
-        if not tweets:
+        if not tweet_texts:
             logger.warning(f"No tweets found for user {user_id}")
             return {"error": "No tweets found"}
 
-        # Extract just the text from tweets
-        tweet_texts = [tweet["text"] for tweet in tweets]
-
         # 4. Use AI to analyze voice and detect niche
-        ai_remixer = AIRemixer()
-        voice_profile = ai_remixer.analyze_voice(tweet_texts)
+        ai_remixer = get_remixer()
+        voice_profile = run_async(ai_remixer.analyze_voice(tweet_texts))
 
         # 5. Update user's voice_profile and detected_niche
         user.voice_profile = voice_profile
@@ -200,6 +265,7 @@ def analyze_user_voice(user_id: int):
         user.updated_at = datetime.utcnow()
 
         db.commit()
+        invalidate_cached_user(user_id)
 
         logger.info(f"Voice analysis complete for user {user_id}. Niche: {user.detected_niche}")
 
@@ -214,6 +280,146 @@ def analyze_user_voice(user_id: int):
         db.close()
 
 
+@celery_app.task(name="prism.finalize_oauth")
+def finalize_oauth(code: str, code_verifier: str, browser_key: str):
+    """
+    Finish X OAuth login: exchange the code, upsert the user, issue our JWT
+
+    Args:
+        code: Authorization code from X
+        code_verifier: PKCE verifier stored when the flow started
+        browser_key: oauth_browser_key() of the browser that started the flow
+
+    Returns:
+        Auth response dict (access_token, token_type, user, browser_key)
+    """
+    from app.models import User
+    from app.x_api import XAPIClient
+    from app.auth import exchange_code_for_token, create_access_token
+    from app.encryption import encrypt_token
+    from app.redis_client import invalidate_cached_user
+
+    db = SessionLocal()
+
+    try:
+        # 1. Exchange code for X access token
+        token_data = run_async(exchange_code_for_token(code, code_verifier))
+
+        access_token = token_data["access_token"]
+        refresh_token = token_data["refresh_token"]
+        expires_in = token_data.get("expires_in", 7200)  # Default 2 hours
+
+        # 2. Get X user info
+        x_client = XAPIClient(access_token=access_token)
+        me_response = x_client.client.get_me(user_fields=["username"])
+        x_user_id = str(me_response.data.id)
+        x_username = me_response.data.username
+
+        # 3. Create or update user in one statement (INSERT ... ON CONFLICT DO UPDATE ... RETURNING)
+        token_values = {
+            "x_username": x_username,
+            "x_access_token": encrypt_token(access_token),
+            "x_refresh_token": encrypt_token(refresh_token),
+            "x_token_expires_at": datetime.utcnow() + timedelta(seconds=expires_in)
+        }
+        user_id, username = db.execute(
+            pg_insert(User)
+            .values(username=x_username, x_user_id=x_user_id, **token_values)
+            .on_conflict_do_update(
+                index_elements=[User.x_user_id],
+                set_={**token_values, "updated_at": func.now()}
+            )
+            .returning(User.id, User.username)
+        ).one()
+        db.commit()
+        invalidate_cached_user(user_id)
+
+        logger.info(f"X account connected for user {user_id}")
+
+        # 4. Trigger voice analysis in background
+        analyze_user_voice.delay(user_id)
+
+        # 5. Create JWT token for our API
+        return {
+            "access_token": create_access_token(data={"sub": user_id}),
+            "token_type": "bearer",
+            "user": {
+                "id": user_id,
+                "username": username,
+                "x_username": x_username
+            },
+            # Checked and stripped by /api/auth/status
+            "browser_key": browser_key
+        }
+
+    except Exception as e:
+        logger.error(f"Error finalizing X OAuth: {e}")
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
+
+
+def _schedule_remixes(db, user, candidates: list, remixes: list, model: str) -> int:
+    """
+    Save remixed viral posts and spread them evenly over the next day
+
+    Args:
+        db: Database session
+        user: User the posts belong to
+        candidates: Viral post dicts from XAPIClient.asearch_viral_posts()
+        remixes: Remixed text (or the exception raised) per candidate
+        model: AI model used
+
+    Returns:
+        Number of posts scheduled
+    """
+    from app.models import Post, ScheduledPost
+
+    now = datetime.utcnow()
+    interval = timedelta(days=1) / max(user.posts_per_day, 1)
+
+    posts = []
+    for vp, remixed in zip(candidates, remixes):
+        if isinstance(remixed, Exception):
+            logger.error(f"Auto-pilot remix failed for tweet {vp['id']}: {remixed}")
+            continue
+
+        posts.append(Post(
+            user_id=user.id,
+            x_post_id=str(vp["id"]),
+            author_username=vp["author_username"],
+            content=vp["text"],
+            engagement_score=vp["engagement_score"],
+            detected_niche=user.detected_niche,
+            source_tweet_stats=vp["metrics"],
+            remixed_content=remixed,
+            ai_model_used=model,
+            is_remixed=True,
+            is_scheduled=True,
+            remixed_at=now
+        ))
+
+    db.add_all(posts)
+    db.flush()
+
+    db.add_all([
+        ScheduledPost(
+            user_id=user.id,
+            original_post_id=post.id,
+            content=post.remixed_content,
+            scheduled_for=now + interval * (i + 1),
+            status="pending"
+        )
+        for i, post in enumerate(posts)
+    ])
+
+    db.commit()
+
+    return len(posts)
+
+
 @celery_app.task(name="prism.auto_pilot")
 def auto_pilot(user_id: int):
     """
@@ -224,12 +430,209 @@ def auto_pilot(user_id: int):
 
     Args:
         user_id: User ID
+
+    Returns:
+        {"scheduled": n}, plus "batch_id" when remixing was deferred to a batch
     """
-    # Implementation:
-    # 1. Discover viral posts
-    # 2. Remix top posts using AI
-    # 3. Schedule remixed posts based on user's posts_per_day setting
-    pass
+    from app.models import User, Post
+    from app.x_api import XAPIClient, split_niches
+    from app.ai_service import get_remixer
+
+    logger.info(f"Starting auto-pilot for user {user_id}")
+
+    db = SessionLocal()
+
+    try:
+        user = db.get(User, user_id)
+        if not user or not user.analysis_complete:
+            logger.warning(f"Skipping auto-pilot for user {user_id}: voice analysis not complete")
+            return {"scheduled": 0}
+
+        # 1. Discover viral posts (app-only auth is enough for search)
+        x_client = XAPIClient()
+        viral_posts = run_async(x_client.asearch_viral_posts(
+            niches=split_niches(user.detected_niche or "") or ["trending"],
+            min_engagement=1000,
+            max_results=50
+        ))
+
+        # Skip posts that have already been remixed
+        seen = set(db.execute(
+            select(Post.x_post_id).where(
+                Post.x_post_id.in_([str(vp["id"]) for vp in viral_posts])
+            )
+        ).scalars())
+        candidates = [vp for vp in viral_posts if str(vp["id"]) not in seen][:user.posts_per_day]
+
+        if not candidates:
+            logger.info(f"No new viral posts for user {user_id}")
+            return {"scheduled": 0}
+
+        model = user.preferred_ai_model or "claude"
+        ai_remixer = get_remixer()
+
+        # 2a. Larger Claude runs go through the (cheaper, slower) batch API;
+        # posts are spread over the next day so a few minutes' delay is fine
+        if model == "claude" and len(candidates) >= settings.ai_batch_min_size:
+            prompts = {
+                str(vp["id"]): ai_remixer.build_remix_prompt(vp["text"], user.voice_profile or {})
+                for vp in candidates
+            }
+            batch_id = run_async(ai_remixer.submit_batch(prompts))
+            poll_batch.apply_async(args=[batch_id, user.id, candidates, model], countdown=60)
+            return {"scheduled": 0, "batch_id": batch_id}
+
+        # 2b. Otherwise remix all candidates concurrently, bounded to respect provider rate limits
+        remixes = run_async(ai_remixer.remix_many(
+            [vp["text"] for vp in candidates],
+            user.voice_profile or {},
+            model,
+            max_concurrency=settings.ai_max_concurrency
+        ))
+
+        # 3. Persist and schedule
+        scheduled = _schedule_remixes(db, user, candidates, remixes, model)
+
+        logger.info(f"Auto-pilot scheduled {scheduled} posts for user {user_id}")
+
+        return {"scheduled": scheduled}
+
+    except Exception as e:
+        logger.error(f"Error in auto-pilot for user {user_id}: {e}")
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
+
+
+@celery_app.task(name="prism.poll_batch", bind=True, max_retries=30)
+def poll_batch(self, batch_id: str, user_id: int, candidates: list, model: str = "claude"):
+    """
+    Poll a Claude message batch submitted by auto_pilot and schedule its results
+
+    Retries with exponential backoff (capped at 1 hour) until the batch ends.
+
+    Args:
+        batch_id: Claude message batch ID
+        user_id: User ID
+        candidates: Viral post dicts the batch was built from
+        model: AI model used
+
+    Returns:
+        {"scheduled": n}
+    """
+    from app.models import User
+    from app.ai_service import get_remixer
+
+    ai_remixer = get_remixer()
+    results = run_async(ai_remixer.get_batch_results(batch_id))
+
+    if results is None:
+        raise self.retry(countdown=min(60 * 2 ** self.request.retries, 3600))
+
+    db = SessionLocal()
+
+    try:
+        user = db.get(User, user_id)
+        if not user:
+            raise ValueError(f"User {user_id} not found")
+
+        remixes = [
+            results.get(str(vp["id"])) or RuntimeError("No batch result")
+            for vp in candidates
+        ]
+        scheduled = _schedule_remixes(db, user, candidates, remixes, model)
+
+        logger.info(f"Batch {batch_id} scheduled {scheduled} posts for user {user_id}")
+
+        return {"scheduled": scheduled}
+
+    except Exception as e:
+        logger.error(f"Error scheduling batch {batch_id} for user {user_id}: {e}")
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
+
+
+@celery_app.task(name="prism.process_stripe_event")
+def process_stripe_event(stripe_event_id: str):
+    """
+    Run the handler for a Stripe webhook event staged by the webhook endpoint
+
+    Args:
+        stripe_event_id: Stripe event ID (evt_...)
+
+    Returns:
+        Processing status dict
+    """
+    from app.models import StripeWebhookEvent
+    from app.redis_client import (
+        redis_client,
+        stripe_event_key,
+        invalidate_cached_user,
+        mark_stripe_event_processed,
+    )
+    from app.stripe_webhooks import EVENT_HANDLERS
+
+    payload = redis_client.get(stripe_event_key(stripe_event_id))
+
+    db = SessionLocal()
+
+    try:
+        # Redelivered events can be queued twice; only the first run does the work
+        processed = db.scalar(
+            select(StripeWebhookEvent.processed)
+            .where(StripeWebhookEvent.stripe_event_id == stripe_event_id)
+            .with_for_update()
+        )
+        if processed:
+            return {"status": "already_processed"}
+
+        if payload is None:
+            # Staging copy expired while the task was queued; the row keeps the original
+            payload = db.scalar(
+                select(StripeWebhookEvent.payload)
+                .where(StripeWebhookEvent.stripe_event_id == stripe_event_id)
+            )
+        if payload is None:
+            logger.error(f"Payload for Stripe event {stripe_event_id} not found")
+            return {"status": "missing"}
+
+        event = orjson.loads(payload)
+
+        # The handler's writes and the processed flag commit together
+        handler = EVENT_HANDLERS.get(event['type'])
+        changed_user_id = handler(event, db) if handler else None
+
+        db.execute(
+            update(StripeWebhookEvent)
+            .where(StripeWebhookEvent.stripe_event_id == stripe_event_id)
+            .values(processed=True, processed_at=datetime.utcnow())
+        )
+        db.commit()
+
+        if changed_user_id is not None:
+            invalidate_cached_user(changed_user_id)
+        mark_stripe_event_processed(stripe_event_id)
+
+        return {"status": "success"}
+
+    except Exception as e:
+        logger.error(f"Error processing Stripe event {stripe_event_id}: {e}")
+        db.rollback()
+        db.execute(
+            update(StripeWebhookEvent)
+            .where(StripeWebhookEvent.stripe_event_id == stripe_event_id)
+            .values(processing_error=str(e))
+        )
+        db.commit()
+        raise
+
+    finally:
+        db.close()
 
 
 # Periodic Tasks (Celery Beat)
@@ -237,12 +640,72 @@ def auto_pilot(user_id: int):
 def process_scheduled_posts():
     """
     Check for scheduled posts that are due and post them
-    Runs every minute
+    Runs every 30 seconds; this is the only path that queues post_scheduled_tweet
+
+    Returns:
+        Number of posts dispatched and of stale dispatches reclaimed
     """
-    # Implementation:
-    # 1. Query scheduled_posts where scheduled_for <= now and status = 'pending'
-    # 2. Trigger post_scheduled_tweet for each
-    pass
+    from app.models import ScheduledPost
+
+    db = SessionLocal()
+
+    try:
+        now = datetime.utcnow()
+
+        # Put back posts whose dispatch never finished (publish failed, worker killed
+        # at task_time_limit, crash before the final status write) so they're retried.
+        # post_scheduled_tweet locks the row and skips posted ones, so a late original
+        # task can't double-post
+        reclaimed = db.execute(
+            update(ScheduledPost)
+            .where(
+                ScheduledPost.status == "dispatched",
+                or_(
+                    ScheduledPost.dispatched_at.is_(None),
+                    ScheduledPost.dispatched_at < now - DISPATCH_STALE_AFTER
+                )
+            )
+            .values(status="pending", dispatched_at=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if reclaimed:
+            logger.warning(f"Reclaimed {reclaimed} stale dispatched posts")
+
+        # One round trip: claim up to 500 due posts, skipping rows another
+        # dispatcher already holds, and mark them so they aren't claimed again
+        due_ids = db.execute(
+            select(ScheduledPost.id).where(
+                ScheduledPost.status == "pending",
+                ScheduledPost.scheduled_for <= now
+            ).order_by(ScheduledPost.scheduled_for).with_for_update(skip_locked=True).limit(500)
+        ).scalars().all()
+
+        if not due_ids:
+            db.commit()
+            return {"dispatched": 0, "reclaimed": reclaimed}
+
+        db.execute(
+            update(ScheduledPost)
+            .where(ScheduledPost.id.in_(due_ids))
+            .values(status="dispatched", dispatched_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+        # Publish all tasks in one go
+        group(post_scheduled_tweet.s(post_id) for post_id in due_ids).apply_async()
+
+        logger.info(f"Dispatched {len(due_ids)} scheduled posts")
+
+        return {"dispatched": len(due_ids), "reclaimed": reclaimed}
+
+    except Exception as e:
+        logger.error(f"Error dispatching scheduled posts: {e}")
+        db.rollback()
+        raise
+
+    finally:
+        db.close()
 
 
 @celery_app.task(name="prism.run_auto_pilot_users")
@@ -1,15 +1,22 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import AsyncIterator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 
 class Settings(BaseSettings):
     # Database
     database_url: str
+    db_pool_size: int = 20  # Per API process; keep workers x (size + overflow) under max_connections / pgbouncer pool
+    db_max_overflow: int = 40
+    db_pool_recycle: int = 1800  # Seconds; stay under server/proxy idle timeouts
     
     # Redis & Celery
     redis_url: str = "redis://localhost:6379/0"
+    redis_pool_size: int = 50  # Max Redis connections per process
     celery_broker_url: str = "redis://localhost:6379/1"
     celery_result_backend: str = "redis://localhost:6379/1"
     
@@ -34,11 +41,19 @@ class Settings(BaseSettings):
     xai_api_key: Optional[str] = None
     grok_api_key: Optional[str] = None
     grok_base_url: str = "https://api.x.ai/v1"
+    ai_max_concurrency: int = 8
+    ai_batch_min_size: int = 5
+    
+    # Stripe
+    stripe_secret_key: Optional[str] = None
+    stripe_pro_price_id: Optional[str] = None
+    stripe_webhook_secret: Optional[str] = None
     
     # App Settings
     app_name: str = "PRISM"
     app_env: str = "development"
     port: int = 8003
+    thread_pool_size: int = 40  # Max worker threads for blocking calls in the API
     
     # Frontend
     frontend_url: str
@@ -55,19 +70,29 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # Database setup
+# Sync engine: Celery workers and scripts
 engine = create_engine(
     settings.database_url,
     pool_pre_ping=True,
     pool_size=10,
-    max_overflow=20
+    max_overflow=20,
+    pool_recycle=settings.db_pool_recycle
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine (asyncpg): FastAPI request handlers, so queries don't block the event loop
+async_engine = create_async_engine(
+    make_url(settings.database_url).set(drivername="postgresql+asyncpg"),
+    pool_pre_ping=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_recycle=settings.db_pool_recycle
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
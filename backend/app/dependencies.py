@@ -5,21 +5,106 @@ Reusable dependency functions for route handlers
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy import DateTime
+from cachetools import TTLCache
+from datetime import datetime
+from typing import Dict, Optional
+import hashlib
+import orjson
+import redis
+import time
 
 from app.database import get_db
-from app.models import User
+from app.models import User, Subscription
 from app.auth import verify_token
+from app.redis_client import (
+    async_redis_client,
+    user_cache_key,
+    USER_CACHE_TTL,
+    check_stripe_action_rate_limit,
+)
 
 
 # OAuth2 scheme for JWT tokens
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# Verified tokens -> (user_id, exp), keyed by SHA256 so raw JWTs aren't held in memory
+_token_cache = TTLCache(maxsize=10_000, ttl=60)
+
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Columns get_current_user's callers read; the rest (hashed_password, the X refresh
+# token, ...) never goes to Redis, which the Celery broker shares
+_CACHED_USER_COLUMNS = (
+    "id",
+    "email",
+    "username",
+    "x_user_id",
+    "x_username",
+    "x_access_token",
+    "x_token_expires_at",
+    "detected_niche",
+    "voice_profile",
+    "analysis_complete",
+    "auto_pilot_enabled",
+    "posts_per_day",
+    "preferred_ai_model",
+    "created_at",
+)
+_CACHED_SUBSCRIPTION_COLUMNS = (
+    "id",
+    "status",
+    "plan_type",
+    "current_period_end",
+    "cancel_at_period_end",
+    "canceled_at",
+)
+
+
+def _columns_to_dict(obj, keys) -> Dict:
+    return {key: getattr(obj, key) for key in keys}
+
+
+def _columns_from_dict(model, data: Dict):
+    for column in model.__table__.columns:
+        if isinstance(column.type, DateTime) and data.get(column.key):
+            data[column.key] = datetime.fromisoformat(data[column.key])
+    return model(**data)
+
+
+def _serialize_user(user: User) -> bytes:
+    """Encode a User (and its subscription, for is_pro) for the Redis cache"""
+    data = _columns_to_dict(user, _CACHED_USER_COLUMNS)
+    data["subscription"] = (
+        _columns_to_dict(user.subscription, _CACHED_SUBSCRIPTION_COLUMNS) if user.subscription else None
+    )
+    return orjson.dumps(data)
+
+
+def _deserialize_user(cached: str) -> User:
+    """
+    Rebuild a cached User as a detached instance
+
+    Read-only: it is not attached to any session, so changes are never flushed.
+    Only the _CACHED_*_COLUMNS are set; other attributes are None.
+    """
+    data = orjson.loads(cached)
+    subscription = data.pop("subscription")
+
+    user = _columns_from_dict(User, data)
+    user.subscription = _columns_from_dict(Subscription, subscription) if subscription else None
+    return user
+
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     """
     Get the current authenticated user from JWT token
@@ -35,21 +120,47 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    # Verify and decode token
-    payload = verify_token(token)
-    if payload is None:
-        raise credentials_exception
-
-    # Extract user ID from token
-    user_id: Optional[int] = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
-
-    # Fetch user from database
-    user = db.query(User).filter(User.id == user_id).first()
+    # Reuse a recent verification of this token while it is still unexpired
+    cache_key = _token_cache_key(token)
+    cached = _token_cache.get(cache_key)
+
+    if cached is not None and cached[1] > time.time():
+        user_id: Optional[int] = cached[0]
+    else:
+        # Verify and decode token
+        payload = verify_token(token)
+        if payload is None:
+            raise credentials_exception
+
+        # Extract user ID from token ("sub" is stored as a string)
+        try:
+            user_id = int(payload["sub"])
+        except (KeyError, TypeError, ValueError):
+            raise credentials_exception
+
+        _token_cache[cache_key] = (user_id, payload.get("exp", 0))
+
+    # Cached row first; invalidated when the user or their subscription changes
+    try:
+        cached = await async_redis_client.get(user_cache_key(user_id))
+    except redis.RedisError:
+        cached = None
+
+    if cached is not None:
+        return _deserialize_user(cached)
+
+    # Fetch user and subscription in one round trip (async sessions can't lazy-load is_pro)
+    user = await db.scalar(
+        select(User).options(joinedload(User.subscription)).where(User.id == user_id)
+    )
     if user is None:
         raise credentials_exception
 
+    try:
+        await async_redis_client.setex(user_cache_key(user_id), USER_CACHE_TTL, _serialize_user(user))
+    except redis.RedisError:
+        pass
+
     return user
 
 
@@ -78,3 +189,26 @@ async def verify_x_connection(
         )
 
     return current_user
+
+
+async def rate_limit_stripe(
+    current_user: User = Depends(get_current_user)
+) -> User:
+    """
+    Throttle billing routes that call the Stripe API (5 per minute per user)
+
+    Fails open if Redis is unavailable.
+    """
+    try:
+        allowed = await check_stripe_action_rate_limit(current_user.id)
+    except redis.RedisError:
+        allowed = True
+
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many billing requests. Please try again in a minute.",
+            headers={"Retry-After": "60"}
+        )
+
+    return current_user
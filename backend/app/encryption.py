@@ -2,24 +2,50 @@
 AES-256 encryption for storing X OAuth tokens
 """
 
+from cachetools import TTLCache
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
+import binascii
+import os
 from app.database import settings
 
+# Legacy Fernet tokens always start with the version byte 0x80 + zeroed timestamp bytes
+_FERNET_PREFIX = "gAAAAA"
+_NONCE_SIZE = 12
+
+
+def _load_key() -> bytes:
+    """
+    Get the 32-byte key from settings.encryption_key
+
+    Accepts a urlsafe-base64 32-byte key (e.g. from Fernet.generate_key());
+    otherwise falls back to the raw key bytes padded/truncated to 32.
+    """
+    try:
+        key = base64.urlsafe_b64decode(settings.encryption_key.encode())
+        if len(key) == 32:
+            return key
+    except (binascii.Error, ValueError):
+        pass
+
+    # In production, use: Fernet.generate_key()
+    return settings.encryption_key.encode()[:32].ljust(32, b'0')
+
 
 class TokenEncryption:
     """
     Encrypt and decrypt X OAuth tokens for secure storage
+
+    New tokens use AES-256-GCM; tokens written by the previous
+    Fernet implementation are still accepted on decrypt.
     """
 
     def __init__(self):
-        # Ensure key is valid Fernet key
-        try:
-            self.cipher = Fernet(settings.encryption_key.encode())
-        except Exception:
-            # If key is not valid base64, generate from raw bytes
-            # In production, use: Fernet.generate_key()
-            self.cipher = Fernet(base64.urlsafe_b64encode(settings.encryption_key.encode()[:32].ljust(32, b'0')))
+        key = _load_key()
+        self.cipher = AESGCM(key)
+        self.legacy_cipher = Fernet(base64.urlsafe_b64encode(key))
 
 
     def encrypt_token(self, token: str) -> str:
@@ -30,10 +56,11 @@ class TokenEncryption:
             token: Plain text token
 
         Returns:
-            Encrypted token (base64 encoded)
+            Encrypted token (base64 encoded nonce + ciphertext)
         """
-        encrypted = self.cipher.encrypt(token.encode())
-        return encrypted.decode()
+        nonce = os.urandom(_NONCE_SIZE)
+        encrypted = self.cipher.encrypt(nonce, token.encode(), None)
+        return base64.urlsafe_b64encode(nonce + encrypted).decode()
 
 
     def decrypt_token(self, encrypted_token: str) -> str:
@@ -46,13 +73,39 @@ class TokenEncryption:
         Returns:
             Plain text token
         """
-        decrypted = self.cipher.decrypt(encrypted_token.encode())
+        data = base64.urlsafe_b64decode(encrypted_token.encode())
+
+        try:
+            decrypted = self.cipher.decrypt(data[:_NONCE_SIZE], data[_NONCE_SIZE:], None)
+        except InvalidTag:
+            if not self.is_legacy(encrypted_token):
+                raise
+            decrypted = self.legacy_cipher.decrypt(encrypted_token.encode())
+
         return decrypted.decode()
 
 
+    @staticmethod
+    def is_legacy(encrypted_token: str) -> bool:
+        """
+        Check whether a stored token was encrypted with the old Fernet scheme
+
+        Args:
+            encrypted_token: Encrypted token (base64 encoded)
+
+        Returns:
+            True if the token should be re-encrypted
+        """
+        return encrypted_token.startswith(_FERNET_PREFIX)
+
+
 # Global instance
 token_encryption = TokenEncryption()
 
+# (user_id, encrypted_token) -> plain text token. Keying on the ciphertext means a
+# refreshed/re-encrypted token never hits a stale entry.
+_access_token_cache = TTLCache(maxsize=5000, ttl=300)
+
 
 def encrypt_token(token: str) -> str:
     """Helper function to encrypt a token"""
@@ -62,3 +115,28 @@ def encrypt_token(token: str) -> str:
 def decrypt_token(encrypted_token: str) -> str:
     """Helper function to decrypt a token"""
     return token_encryption.decrypt_token(encrypted_token)
+
+
+def is_legacy_token(encrypted_token: str) -> bool:
+    """Helper function to detect Fernet-encrypted tokens"""
+    return token_encryption.is_legacy(encrypted_token)
+
+
+def get_access_token(user) -> str:
+    """
+    Get a user's decrypted X access token, cached per process for 5 minutes
+
+    Args:
+        user: User with an encrypted x_access_token
+
+    Returns:
+        Plain text access token
+    """
+    key = (user.id, user.x_access_token)
+
+    access_token = _access_token_cache.get(key)
+    if access_token is None:
+        access_token = decrypt_token(user.x_access_token)
+        _access_token_cache[key] = access_token
+
+    return access_token
@@ -0,0 +1,128 @@
+"""
+LLM response cache
+In-process TTL cache mirrored to Redis for AI responses
+"""
+
+from cachetools import TTLCache
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+import hashlib
+import json
+import logging
+import redis
+from app.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """
+    Two-level cache for LLM responses
+    Checks the local TTL/LRU cache first, then the shared Redis copy
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 3600, prefix: str = "llm_cache"):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """
+        Build a cache key from model and prompt
+
+        Args:
+            model: Model/purpose identifier (e.g., "claude")
+            prompt: Full prompt sent to the model
+
+        Returns:
+            SHA256 hex digest
+        """
+        payload = json.dumps({"model": model, "prompt": prompt}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached response
+
+        Args:
+            key: Key from make_key()
+
+        Returns:
+            Cached value, or None on miss
+        """
+        value = self.local.get(key)
+
+        if value is None:
+            try:
+                cached = await async_redis_client.get(f"{self.prefix}:{key}")
+            except redis.RedisError as e:
+                logger.warning(f"LLM cache read failed: {e}")
+                cached = None
+
+            if cached is not None:
+                value = json.loads(cached)
+                self.local[key] = value
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int = 3600) -> None:
+        """
+        Store a response locally and in Redis
+
+        Args:
+            key: Key from make_key()
+            value: JSON-serializable response
+            ttl: Redis expiry in seconds
+        """
+        self.local[key] = value
+
+        try:
+            await async_redis_client.setex(f"{self.prefix}:{key}", ttl, json.dumps(value))
+        except redis.RedisError as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "local_size": len(self.local)
+        }
+
+
+# Global instance
+llm_cache = LLMResponseCache()
+
+
+def cached_llm(model: str, ttl: int = 3600) -> Callable:
+    """
+    Cache an async `(self, prompt) -> str` LLM call
+
+    Usage:
+        @cached_llm("claude", ttl=3600)
+        async def _remix_with_claude(self, prompt: str) -> str:
+            ...
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(self, prompt: str) -> str:
+            key = llm_cache.make_key(model, prompt)
+
+            cached = await llm_cache.get(key)
+            if cached is not None:
+                return cached
+
+            result = await func(self, prompt)
+            await llm_cache.set(key, result, ttl)
+            return result
+
+        return wrapper
+
+    return decorator
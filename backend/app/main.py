@@ -3,48 +3,108 @@ PRISM Backend API
 Main FastAPI application
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, BackgroundTasks, Cookie, Depends, HTTPException, Query, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, JSONResponse
-from pydantic_settings import BaseSettings
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from fastapi.responses import RedirectResponse, ORJSONResponse, Response
+from sqlalchemy import bindparam, delete, func, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+import anyio
+import asyncio
+import logging
+import orjson
+import redis
 import secrets
-import os
 
-from app.database import get_db, settings
+from app.database import get_db, settings, async_engine
 from app.models import User, Post, ScheduledPost, Subscription, PaymentHistory, StripeWebhookEvent
-from app.schemas import UserResponse, Token
-from app.dependencies import get_current_user
+from app.schemas import UserResponse
+from app.dependencies import get_current_user, rate_limit_stripe
 from app.auth import (
     get_x_oauth_url,
-    exchange_code_for_token,
-    create_access_token
+    verify_oauth_state,
+    close_x_http,
+    create_oauth_browser_nonce,
+    oauth_browser_key,
+    OAUTH_BROWSER_COOKIE,
+    OAUTH_STATE_TTL
 )
-from app.encryption import encrypt_token, decrypt_token
-from app.redis_client import redis_client
-from app.celery_app import analyze_user_voice, post_scheduled_tweet
-from app.x_api import XAPIClient
-from app.ai_service import AIRemixer
+from app.encryption import get_access_token
+from app.redis_client import (
+    async_redis_client,
+    ainvalidate_cached_user,
+    close_async_redis,
+    stripe_event_key,
+    STRIPE_EVENT_TTL,
+    is_stripe_event_processed,
+    get_cached_tweet_metrics,
+    cache_tweet_metrics,
+)
+from app.celery_app import celery_app, analyze_user_voice, finalize_oauth, process_stripe_event
+from celery.result import AsyncResult
+from celery.utils import uuid as celery_uuid
+from app.x_api import XAPIClient, close_x_api_http, split_niches, MAX_SEARCH_NICHES
+from app.ai_service import get_remixer
+from app.llm_cache import llm_cache
 from app.stripe_service import StripeService
-from app.stripe_webhooks import WebhookHandler
 import stripe
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: bound the worker threads used for blocking calls. Starlette's sync
+    # routes/dependencies/background tasks use AnyIO's limiter; asyncio.to_thread
+    # (tweepy, Stripe) uses the loop's default executor.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.thread_pool_size
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.thread_pool_size)
+    )
+    yield
+    # Shutdown: release pooled HTTP, Redis and DB connections
+    await close_x_http()
+    await close_x_api_http()
+    await close_async_redis()
+    await async_engine.dispose()
+
+
+class UTCORJSONResponse(ORJSONResponse):
+    """
+    orjson response that also tags naive datetimes as UTC
+
+    Return it directly (instead of a dict) to skip FastAPI's jsonable_encoder
+    pass and let orjson serialize datetimes natively.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+
 
 app = FastAPI(
     title=settings.app_name,
     description="X Growth Automation - AI-powered tweet remixing and scheduling",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=UTCORJSONResponse
 )
 
-# CORS
+# CORS - explicit lists so preflights are answered without wildcard handling
+CORS_ORIGINS = [o.strip() for o in settings.allowed_origins.split(",") if o.strip()]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.allowed_origins.split(","),
+    allow_origins=CORS_ORIGINS,
+    allow_origin_regex=None,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=600,
 )
 
 
@@ -63,26 +123,42 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Process-local cache counters
+    """
+    return {
+        "llm_cache": llm_cache.stats()
+    }
+
+
 # ============================================================================
 # AUTHENTICATION & OAUTH ROUTES
 # ============================================================================
 
 @app.get("/api/auth/connect")
-async def connect_x_account():
+async def connect_x_account(response: Response):
     """
     Start X OAuth 2.0 flow with PKCE
 
+    Sets the OAuth browser cookie that /api/auth/status requires.
+
     Returns:
         Redirect to X authorization URL
     """
-    # Generate random state for CSRF protection
-    state = secrets.token_urlsafe(32)
-
-    # Generate OAuth URL and code_verifier
-    auth_url, code_verifier = get_x_oauth_url(state)
-
-    # Store state and code_verifier in Redis (expires in 10 minutes)
-    redis_client.setex(f"oauth_state:{state}", 600, code_verifier)
+    # Generate OAuth URL; the state is signed and carries the code_verifier (expires in 10 minutes)
+    auth_url, state = get_x_oauth_url()
+
+    response.set_cookie(
+        OAUTH_BROWSER_COOKIE,
+        create_oauth_browser_nonce(),
+        max_age=OAUTH_STATE_TTL,
+        path="/api/auth",
+        httponly=True,
+        secure=settings.frontend_url.startswith("https://"),
+        samesite="lax"
+    )
 
     return {
         "authorization_url": auth_url,
@@ -94,20 +170,22 @@ async def connect_x_account():
 async def oauth_callback(
     code: str,
     state: str,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    browser_nonce: Optional[str] = Cookie(None, alias=OAUTH_BROWSER_COOKIE)
 ):
     """
-    OAuth callback - exchange code for tokens
+    OAuth callback - verify state and hand the token exchange to a worker
 
     Args:
         code: Authorization code from X
         state: State parameter for CSRF protection
+        browser_nonce: OAuth browser cookie set by /api/auth/connect
 
     Returns:
-        JWT access token for our API
+        Redirect to the frontend, which polls /api/auth/status/{task_id}
     """
-    # Verify state and get code_verifier from Redis
-    code_verifier = redis_client.get(f"oauth_state:{state}")
+    # Verify state and recover its code_verifier
+    code_verifier = verify_oauth_state(state)
 
     if not code_verifier:
         raise HTTPException(
@@ -115,73 +193,75 @@ async def oauth_callback(
             detail="Invalid or expired state parameter"
         )
 
-    # Delete state from Redis
-    redis_client.delete(f"oauth_state:{state}")
+    if not browser_nonce:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Login must be finished in the browser that started it"
+        )
 
-    try:
-        # Exchange code for X access token
-        token_data = await exchange_code_for_token(code, code_verifier)
-
-        access_token = token_data["access_token"]
-        refresh_token = token_data["refresh_token"]
-        expires_in = token_data.get("expires_in", 7200)  # Default 2 hours
-
-        # Get user info from X API
-        x_client = XAPIClient(access_token=access_token)
-
-        # Use the "me" endpoint to get current user
-        # For now, we'll need the user ID - tweepy might need adjustment
-        # This is a placeholder - actual implementation depends on Tweepy version
-        me_response = x_client.client.get_me(user_fields=["username"])
-        x_user_id = str(me_response.data.id)
-        x_username = me_response.data.username
-
-        # Check if user already exists
-        user = db.query(User).filter(User.x_user_id == x_user_id).first()
-
-        if not user:
-            # Create new user
-            user = User(
-                username=x_username,
-                x_user_id=x_user_id,
-                x_username=x_username,
-                x_access_token=encrypt_token(access_token),
-                x_refresh_token=encrypt_token(refresh_token),
-                x_token_expires_at=datetime.utcnow() + timedelta(seconds=expires_in)
-            )
-            db.add(user)
-        else:
-            # Update existing user's tokens
-            user.x_access_token = encrypt_token(access_token)
-            user.x_refresh_token = encrypt_token(refresh_token)
-            user.x_token_expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-            user.x_username = x_username
+    # Token exchange, X lookup and user upsert run in Celery. The task ID is chosen
+    # up front so the broker publish can happen after the redirect is sent.
+    task_id = celery_uuid()
+    background_tasks.add_task(
+        finalize_oauth.apply_async,
+        args=[code, code_verifier, oauth_browser_key(browser_nonce)],
+        task_id=task_id
+    )
 
-        db.commit()
-        db.refresh(user)
+    return RedirectResponse(url=f"{settings.frontend_url}/?oauth_task={task_id}")
 
-        # Trigger voice analysis in background
-        analyze_user_voice.delay(user.id)
 
-        # Create JWT token for our API
-        jwt_token = create_access_token(data={"sub": user.id})
+@app.get("/api/auth/status/{task_id}")
+def oauth_status(
+    task_id: str,
+    response: Response,
+    browser_nonce: Optional[str] = Cookie(None, alias=OAUTH_BROWSER_COOKIE)
+):
+    """
+    Poll the result of an OAuth callback
 
-        return {
-            "access_token": jwt_token,
-            "token_type": "bearer",
-            "user": {
-                "id": user.id,
-                "username": user.username,
-                "x_username": user.x_username
-            }
-        }
+    The task ID travels in a URL, so the result is only handed to the browser
+    holding the OAuth browser cookie from /api/auth/connect.
 
-    except Exception as e:
+    Args:
+        task_id: Celery task ID from the callback redirect
+        browser_nonce: OAuth browser cookie set by /api/auth/connect
+
+    Returns:
+        {"status": "pending"} until ready, then JWT access token for our API
+    """
+    if not browser_nonce:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Login was started in a different browser"
+        )
+
+    result = AsyncResult(task_id, app=celery_app)
+
+    if not result.ready():
+        return {"status": "pending"}
+
+    if result.failed():
+        logger.error(f"OAuth task {task_id} failed: {result.result!r}")
+        result.forget()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to exchange code for token: {str(e)}"
+            detail="Failed to connect X account"
+        )
+
+    auth_response = dict(result.result)
+    if not secrets.compare_digest(auth_response.pop("browser_key", ""), oauth_browser_key(browser_nonce)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Login was started in a different browser"
         )
 
+    # One-shot: the JWT is removed from the result backend once handed out
+    result.forget()
+    response.delete_cookie(OAUTH_BROWSER_COOKIE, path="/api/auth")
+
+    return {"status": "complete", **auth_response}
+
 
 @app.get("/api/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
@@ -199,10 +279,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 # ============================================================================
 
 @app.post("/api/user/voice/analyze")
-async def trigger_voice_analysis(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+def trigger_voice_analysis(current_user: User = Depends(get_current_user)):
     """
     Trigger voice analysis for current user
 
@@ -262,6 +339,13 @@ class ScheduleRequest(BaseModel):
     scheduled_time: datetime
 
 
+# Seconds to reuse a viral-post search for the same niche/filters
+DISCOVER_CACHE_TTL = 180
+
+# Scheduled post statuses shown in the queue
+QUEUE_STATUSES = ["pending", "dispatched", "posted", "failed"]
+
+
 @app.get("/api/discover")
 async def discover_posts(
     niche: Optional[str] = None,
@@ -286,23 +370,51 @@ async def discover_posts(
             detail="X account not connected"
         )
 
+    if niche is not None and len(split_niches(niche)) > MAX_SEARCH_NICHES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_SEARCH_NICHES} niches can be searched at once"
+        )
+
     # Use user's niche if not provided
     search_niche = niche or current_user.detected_niche or "trending"
 
+    # Only the voice profile's niche list fans out; caller input is a single search
+    if niche:
+        niches = [niche]
+    else:
+        niches = split_niches(search_niche) or [search_niche]
+
+    # Search results are app-only (bearer token), so users in the same niche share them
+    cache_key = f"discover:{search_niche.lower()}:{min_likes}:{max_results}"
+    try:
+        cached = await async_redis_client.get(cache_key)
+    except redis.RedisError:
+        cached = None
+
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
     try:
         # Use bearer token for search (read-only)
         x_client = XAPIClient()
-        viral_posts = x_client.search_viral_posts(
-            niche=search_niche,
+        viral_posts = await x_client.asearch_viral_posts(
+            niches=niches,
             min_engagement=min_likes,
             max_results=max_results
         )
 
-        return {
+        result = {
             "niche": search_niche,
             "count": len(viral_posts),
             "posts": viral_posts
         }
+        try:
+            await async_redis_client.setex(cache_key, DISCOVER_CACHE_TTL, orjson.dumps(result))
+        except redis.RedisError:
+            pass
+
+        return result
 
     except Exception as e:
         raise HTTPException(
@@ -315,7 +427,7 @@ async def discover_posts(
 async def remix_post(
     request: RemixRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Remix a viral post using AI in user's voice
@@ -336,8 +448,8 @@ async def remix_post(
 
     try:
         # Use AI to remix the content
-        ai_remixer = AIRemixer()
-        remixed_content = ai_remixer.remix_tweet(
+        ai_remixer = get_remixer()
+        remixed_content = await ai_remixer.remix_tweet(
             original_content=request.source_text,
             voice_profile=current_user.voice_profile,
             model=request.model
@@ -346,14 +458,15 @@ async def remix_post(
         # Save to Post table
         new_post = Post(
             user_id=current_user.id,
-            content=remixed_content,
-            source_tweet_id=request.source_tweet_id,
-            ai_model=request.model,
-            status="draft"
+            x_post_id=request.source_tweet_id,
+            content=request.source_text,
+            remixed_content=remixed_content,
+            ai_model_used=request.model,
+            is_remixed=True,
+            remixed_at=datetime.utcnow()
         )
         db.add(new_post)
-        db.commit()
-        db.refresh(new_post)
+        await db.commit()
 
         return {
             "post_id": new_post.id,
@@ -364,7 +477,7 @@ async def remix_post(
         }
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to remix post: {str(e)}"
@@ -379,7 +492,7 @@ async def remix_post(
 async def schedule_post(
     request: ScheduleRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Schedule a remixed post for future posting
@@ -391,18 +504,6 @@ async def schedule_post(
     Returns:
         Scheduled post details
     """
-    # Get the post
-    post = db.query(Post).filter(
-        Post.id == request.post_id,
-        Post.user_id == current_user.id
-    ).first()
-
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Post not found"
-        )
-
     # Validate scheduled time is in the future
     if request.scheduled_time <= datetime.utcnow():
         raise HTTPException(
@@ -411,79 +512,153 @@ async def schedule_post(
         )
 
     try:
-        # Create ScheduledPost
-        scheduled_post = ScheduledPost(
-            user_id=current_user.id,
-            post_id=post.id,
-            content=post.content,
-            scheduled_for=request.scheduled_time,
-            status="pending"
+        # Create ScheduledPost straight from the user's Post (INSERT ... SELECT, one round trip)
+        result = await db.execute(
+            insert(ScheduledPost)
+            .from_select(
+                ["user_id", "original_post_id", "content", "scheduled_for", "status"],
+                select(
+                    Post.user_id,
+                    Post.id,
+                    Post.remixed_content,
+                    literal(request.scheduled_time, ScheduledPost.scheduled_for.type),
+                    literal("pending")
+                ).where(
+                    Post.id == request.post_id,
+                    Post.user_id == current_user.id
+                )
+            )
+            .returning(ScheduledPost.id, ScheduledPost.content)
+        )
+        scheduled_post = result.first()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to schedule post: {str(e)}"
         )
-        db.add(scheduled_post)
-        db.commit()
-        db.refresh(scheduled_post)
 
-        # Queue Celery task with ETA
-        post_scheduled_tweet.apply_async(
-            args=[scheduled_post.id],
-            eta=request.scheduled_time
+    if scheduled_post is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Post not found"
         )
 
-        return {
+    try:
+        # Posted by the process_scheduled_posts beat task once due
+        await db.commit()
+
+        return UTCORJSONResponse({
             "scheduled_post_id": scheduled_post.id,
-            "post_id": post.id,
-            "content": post.content,
-            "scheduled_for": request.scheduled_time.isoformat(),
+            "post_id": request.post_id,
+            "content": scheduled_post.content,
+            "scheduled_for": request.scheduled_time,
             "status": "pending"
-        }
+        })
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to schedule post: {str(e)}"
         )
 
 
-@app.get("/api/schedule/queue")
+@app.get("/api/schedule/queue", response_model=None)
 async def get_queue(
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get user's scheduled posts queue
 
+    Args:
+        status: Only return posts with this status (pending/dispatched/posted/failed)
+        limit: Page size
+        cursor: next_cursor from the previous page
+
     Returns:
-        List of scheduled posts ordered by scheduled_for
+        One page of scheduled posts ordered by scheduled_for (newest first),
+        next_cursor (None on the last page), and on the first page the total
+        matching count plus a per-status breakdown
     """
-    scheduled_posts = db.query(ScheduledPost).filter(
+    statuses = [status_filter] if status_filter else QUEUE_STATUSES
+    where = [
         ScheduledPost.user_id == current_user.id,
-        ScheduledPost.status.in_(["pending", "posted", "failed"])
-    ).order_by(ScheduledPost.scheduled_for.desc()).all()
-
-    return {
-        "count": len(scheduled_posts),
+        ScheduledPost.status.in_(statuses)
+    ]
+
+    total = None
+    counts = None
+    if cursor is None:
+        # One grouped count so the page can show totals without loading every page
+        counts = dict.fromkeys(statuses, 0)
+        counts.update((await db.execute(
+            select(ScheduledPost.status, func.count())
+            .where(*where)
+            .group_by(ScheduledPost.status)
+        )).all())
+        total = sum(counts.values())
+    else:
+        # Keyset pagination: continue strictly after the last (scheduled_for, id) seen
+        try:
+            cursor_time, cursor_id = cursor.rsplit("|", 1)
+            after = (datetime.fromisoformat(cursor_time), int(cursor_id))
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        where.append(tuple_(ScheduledPost.scheduled_for, ScheduledPost.id) < after)
+
+    scheduled_posts = (await db.scalars(
+        select(ScheduledPost).options(load_only(
+            ScheduledPost.id,
+            ScheduledPost.original_post_id,
+            ScheduledPost.content,
+            ScheduledPost.scheduled_for,
+            ScheduledPost.status,
+            ScheduledPost.posted_at,
+            ScheduledPost.x_post_id,
+            ScheduledPost.error_message
+        )).where(*where)
+        .order_by(ScheduledPost.scheduled_for.desc(), ScheduledPost.id.desc())
+        .limit(limit)
+    )).all()
+
+    next_cursor = None
+    if len(scheduled_posts) == limit:
+        last = scheduled_posts[-1]
+        next_cursor = f"{last.scheduled_for.isoformat()}|{last.id}"
+
+    return UTCORJSONResponse({
+        "count": total,
+        "counts": counts,
+        "next_cursor": next_cursor,
         "posts": [
             {
                 "id": sp.id,
-                "post_id": sp.post_id,
+                "post_id": sp.original_post_id,
                 "content": sp.content,
-                "scheduled_for": sp.scheduled_for.isoformat(),
+                "scheduled_for": sp.scheduled_for,
                 "status": sp.status,
-                "posted_at": sp.posted_at.isoformat() if sp.posted_at else None,
+                "posted_at": sp.posted_at,
                 "x_post_id": sp.x_post_id,
                 "error_message": sp.error_message
             }
             for sp in scheduled_posts
         ]
-    }
+    })
 
 
 @app.delete("/api/schedule/{scheduled_post_id}")
 async def delete_scheduled(
     scheduled_post_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Cancel/delete a scheduled post
@@ -494,89 +669,130 @@ async def delete_scheduled(
     Returns:
         Success message
     """
-    scheduled_post = db.query(ScheduledPost).filter(
-        ScheduledPost.id == scheduled_post_id,
-        ScheduledPost.user_id == current_user.id
-    ).first()
-
-    if not scheduled_post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Scheduled post not found"
+    try:
+        # Ownership and status check in the same statement as the delete
+        deleted_id = await db.scalar(
+            delete(ScheduledPost)
+            .where(
+                ScheduledPost.id == scheduled_post_id,
+                ScheduledPost.user_id == current_user.id,
+                ScheduledPost.status != "posted"
+            )
+            .returning(ScheduledPost.id)
         )
-
-    if scheduled_post.status == "posted":
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot delete already posted tweet"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to delete scheduled post: {str(e)}"
         )
 
-    try:
-        db.delete(scheduled_post)
-        db.commit()
+    if deleted_id is None:
+        # Nothing deleted: find out why (only on the error path)
+        current_status = await db.scalar(
+            select(ScheduledPost.status).where(
+                ScheduledPost.id == scheduled_post_id,
+                ScheduledPost.user_id == current_user.id
+            )
+        )
 
-        return {
-            "success": True,
-            "message": f"Scheduled post {scheduled_post_id} deleted"
-        }
+        if current_status == "posted":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot delete already posted tweet"
+            )
 
-    except Exception as e:
-        db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete scheduled post: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Scheduled post not found"
         )
 
+    return {
+        "success": True,
+        "message": f"Scheduled post {scheduled_post_id} deleted"
+    }
+
 
 # ============================================================================
 # ANALYTICS ROUTES
 # ============================================================================
 
-@app.get("/api/analytics/posts")
+@app.get("/api/analytics/posts", response_model=None)
 async def get_post_analytics(
+    include_total: bool = False,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get analytics for user's published posts
+    Get analytics for user's 50 most recent published posts
+
+    Args:
+        include_total: Also count all of the user's published posts
 
     Returns:
         List of posts with engagement metrics
     """
-    # Get all posted ScheduledPosts with x_post_id
-    posted = db.query(ScheduledPost).filter(
+    where = (
         ScheduledPost.user_id == current_user.id,
         ScheduledPost.status == "posted",
         ScheduledPost.x_post_id.isnot(None)
-    ).order_by(ScheduledPost.posted_at.desc()).limit(50).all()
+    )
+
+    total = None
+    if include_total:
+        total = await db.scalar(select(func.count()).select_from(ScheduledPost).where(*where))
+
+    # Get the latest posted ScheduledPosts with x_post_id as plain rows
+    posted = (await db.execute(
+        select(
+            ScheduledPost.id,
+            ScheduledPost.content,
+            ScheduledPost.posted_at,
+            ScheduledPost.x_post_id
+        ).where(*where).order_by(ScheduledPost.posted_at.desc()).limit(50)
+    )).all()
+
+    # Nothing else needs the database; return the connection before waiting on X
+    await db.close()
 
     if not posted:
-        return {"count": 0, "posts": []}
+        return {"returned": 0, "total": total, "posts": []}
 
     try:
-        # Get fresh analytics from X API
-        access_token = decrypt_token(current_user.x_access_token)
-        x_client = XAPIClient(access_token=access_token)
+        # Metrics change slowly; only ask X for tweets not cached in the last 5 minutes
+        x_post_ids = [sp.x_post_id for sp in posted]
+        metrics_by_id = await get_cached_tweet_metrics(x_post_ids)
+
+        misses = [x_post_id for x_post_id in x_post_ids if x_post_id not in metrics_by_id]
+        if misses:
+            access_token = get_access_token(current_user)
+            x_client = XAPIClient(access_token=access_token)
+
+            fresh = await x_client.aget_tweets_bulk_metrics(misses)
+            await cache_tweet_metrics(fresh)
+            metrics_by_id.update(fresh)
 
         analytics = []
         for sp in posted:
-            try:
-                metrics = x_client.get_tweet_analytics(sp.x_post_id)
-                analytics.append({
-                    "scheduled_post_id": sp.id,
-                    "content": sp.content,
-                    "posted_at": sp.posted_at.isoformat(),
-                    "x_post_id": sp.x_post_id,
-                    "metrics": metrics
-                })
-            except Exception as e:
-                # If can't fetch metrics for one tweet, skip it
+            metrics = metrics_by_id.get(sp.x_post_id)
+            if metrics is None:
+                # Tweet deleted or unavailable, skip it
                 continue
 
-        return {
-            "count": len(analytics),
+            analytics.append({
+                "scheduled_post_id": sp.id,
+                "content": sp.content,
+                "posted_at": sp.posted_at,
+                "x_post_id": sp.x_post_id,
+                "metrics": metrics
+            })
+
+        return UTCORJSONResponse({
+            "returned": len(analytics),
+            "total": total,
             "posts": analytics
-        }
+        })
 
     except Exception as e:
         raise HTTPException(
@@ -589,10 +805,29 @@ async def get_post_analytics(
 # STRIPE & BILLING ROUTES
 # ============================================================================
 
+# One statement text for every billing route, so asyncpg's per-connection
+# prepared statement cache parses and plans it once
+_subscription_by_user = select(Subscription).where(Subscription.user_id == bindparam("user_id"))
+
+
+async def get_user_subscription(db: AsyncSession, user_id: int) -> Optional[Subscription]:
+    """
+    Load a user's subscription attached to this session (for routes that modify it)
+
+    Args:
+        db: Database session
+        user_id: User ID
+
+    Returns:
+        Subscription, or None if the user has never started checkout
+    """
+    return await db.scalar(_subscription_by_user, {"user_id": user_id})
+
+
 @app.post("/api/billing/create-checkout")
 async def create_checkout_session(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(rate_limit_stripe),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create Stripe Checkout session for Pro subscription
@@ -601,13 +836,11 @@ async def create_checkout_session(
         Checkout session URL and ID
     """
     # Get or create subscription record
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    subscription = await get_user_subscription(db, current_user.id)
 
     if not subscription:
         # Create Stripe customer
-        customer_id = StripeService.create_customer(current_user)
+        customer_id = await asyncio.to_thread(StripeService.create_customer, current_user)
 
         # Create subscription record
         subscription = Subscription(
@@ -618,8 +851,8 @@ async def create_checkout_session(
             plan_type='free'
         )
         db.add(subscription)
-        db.commit()
-        db.refresh(subscription)
+        await db.commit()
+        await ainvalidate_cached_user(current_user.id)
 
     # Check if already pro
     if subscription.status == 'active' and subscription.plan_type == 'pro':
@@ -630,7 +863,8 @@ async def create_checkout_session(
 
     try:
         # Create checkout session
-        session_data = StripeService.create_checkout_session(
+        session_data = await asyncio.to_thread(
+            StripeService.create_checkout_session,
             user=current_user,
             subscription=subscription,
             success_url=f"{settings.frontend_url}/dashboard?upgrade=success",
@@ -648,8 +882,8 @@ async def create_checkout_session(
 
 @app.post("/api/billing/create-portal")
 async def create_portal_session(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(rate_limit_stripe),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Create Stripe Customer Portal session
@@ -657,9 +891,7 @@ async def create_portal_session(
     Returns:
         Portal session URL
     """
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    subscription = await get_user_subscription(db, current_user.id)
 
     if not subscription or not subscription.stripe_customer_id:
         raise HTTPException(
@@ -668,7 +900,8 @@ async def create_portal_session(
         )
 
     try:
-        portal_data = StripeService.create_portal_session(
+        portal_data = await asyncio.to_thread(
+            StripeService.create_portal_session,
             customer_id=subscription.stripe_customer_id,
             return_url=f"{settings.frontend_url}/settings"
         )
@@ -683,19 +916,15 @@ async def create_portal_session(
 
 
 @app.get("/api/billing/subscription")
-async def get_subscription_status(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
+async def get_subscription_status(current_user: User = Depends(get_current_user)):
     """
     Get current user's subscription status
 
     Returns:
         Subscription details
     """
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    # Loaded (and Redis-cached) with the user; the cache is invalidated by the Stripe webhooks
+    subscription = current_user.subscription
 
     if not subscription:
         return {
@@ -704,20 +933,20 @@ async def get_subscription_status(
             "is_pro": False
         }
 
-    return {
+    return UTCORJSONResponse({
         "plan_type": subscription.plan_type,
         "status": subscription.status,
         "is_pro": current_user.is_pro,
-        "current_period_end": subscription.current_period_end.isoformat() if subscription.current_period_end else None,
+        "current_period_end": subscription.current_period_end,
         "cancel_at_period_end": subscription.cancel_at_period_end,
-        "canceled_at": subscription.canceled_at.isoformat() if subscription.canceled_at else None
-    }
+        "canceled_at": subscription.canceled_at
+    })
 
 
 @app.post("/api/billing/cancel")
 async def cancel_subscription(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(rate_limit_stripe),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Cancel subscription at period end
@@ -725,9 +954,7 @@ async def cancel_subscription(
     Returns:
         Updated subscription status
     """
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    subscription = await get_user_subscription(db, current_user.id)
 
     if not subscription or not subscription.stripe_subscription_id:
         raise HTTPException(
@@ -743,20 +970,21 @@ async def cancel_subscription(
 
     try:
         # Cancel at period end via Stripe
-        StripeService.cancel_subscription(subscription.stripe_subscription_id)
+        await asyncio.to_thread(StripeService.cancel_subscription, subscription.stripe_subscription_id)
 
         # Update local record
         subscription.cancel_at_period_end = True
-        db.commit()
+        await db.commit()
+        await ainvalidate_cached_user(current_user.id)
 
-        return {
+        return UTCORJSONResponse({
             "success": True,
             "message": "Subscription will be canceled at period end",
-            "period_end": subscription.current_period_end.isoformat()
-        }
+            "period_end": subscription.current_period_end
+        })
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to cancel subscription: {str(e)}"
@@ -765,8 +993,8 @@ async def cancel_subscription(
 
 @app.post("/api/billing/reactivate")
 async def reactivate_subscription(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(rate_limit_stripe),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Reactivate a subscription set to cancel
@@ -774,9 +1002,7 @@ async def reactivate_subscription(
     Returns:
         Updated subscription status
     """
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    subscription = await get_user_subscription(db, current_user.id)
 
     if not subscription or not subscription.stripe_subscription_id:
         raise HTTPException(
@@ -792,11 +1018,12 @@ async def reactivate_subscription(
 
     try:
         # Reactivate via Stripe
-        StripeService.reactivate_subscription(subscription.stripe_subscription_id)
+        await asyncio.to_thread(StripeService.reactivate_subscription, subscription.stripe_subscription_id)
 
         # Update local record
         subscription.cancel_at_period_end = False
-        db.commit()
+        await db.commit()
+        await ainvalidate_cached_user(current_user.id)
 
         return {
             "success": True,
@@ -804,37 +1031,58 @@ async def reactivate_subscription(
         }
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to reactivate subscription: {str(e)}"
         )
 
 
-@app.get("/api/billing/history")
+@app.get("/api/billing/history", response_model=None)
 async def get_payment_history(
+    include_total: bool = False,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get user's payment history
+    Get user's 50 most recent payments
+
+    Args:
+        include_total: Also count all of the user's payments
 
     Returns:
         List of past payments
     """
-    subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id
-    ).first()
+    subscription = current_user.subscription
 
     if not subscription:
-        return {"count": 0, "payments": []}
+        return {"returned": 0, "total": 0 if include_total else None, "payments": []}
 
-    payments = db.query(PaymentHistory).filter(
-        PaymentHistory.subscription_id == subscription.id
-    ).order_by(PaymentHistory.created_at.desc()).limit(50).all()
+    total = None
+    if include_total:
+        total = await db.scalar(
+            select(func.count()).select_from(PaymentHistory).where(
+                PaymentHistory.subscription_id == subscription.id
+            )
+        )
 
-    return {
-        "count": len(payments),
+    payments = (await db.scalars(
+        select(PaymentHistory).options(load_only(
+            PaymentHistory.id,
+            PaymentHistory.amount,
+            PaymentHistory.currency,
+            PaymentHistory.status,
+            PaymentHistory.description,
+            PaymentHistory.paid_at,
+            PaymentHistory.failure_reason
+        )).where(
+            PaymentHistory.subscription_id == subscription.id
+        ).order_by(PaymentHistory.created_at.desc()).limit(50)
+    )).all()
+
+    return UTCORJSONResponse({
+        "returned": len(payments),
+        "total": total,
         "payments": [
             {
                 "id": p.id,
@@ -842,20 +1090,25 @@ async def get_payment_history(
                 "currency": p.currency.upper(),
                 "status": p.status,
                 "description": p.description,
-                "paid_at": p.paid_at.isoformat() if p.paid_at else None,
+                "paid_at": p.paid_at,
                 "failure_reason": p.failure_reason
             }
             for p in payments
         ]
-    }
+    })
 
 
 @app.post("/api/webhooks/stripe")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
     """
     Handle Stripe webhook events
 
-    Processes subscription lifecycle events
+    Records the event and queues it for process_stripe_event, so Stripe
+    gets its 200 without waiting on the subscription lifecycle handlers.
+    If the event can't be staged or queued, returns 503 so Stripe redelivers.
     """
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
@@ -868,52 +1121,42 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    # Check if event already processed (idempotency)
-    existing_event = db.query(StripeWebhookEvent).filter(
-        StripeWebhookEvent.stripe_event_id == event['id']
-    ).first()
-
-    if existing_event and existing_event.processed:
+    # Redeliveries of recently processed events never reach the database
+    if await is_stripe_event_processed(event['id']):
         return {"status": "already_processed"}
 
-    # Create or update event record
-    if not existing_event:
-        webhook_event = StripeWebhookEvent(
-            stripe_event_id=event['id'],
-            event_type=event['type']
-        )
-        db.add(webhook_event)
-        db.commit()
-        db.refresh(webhook_event)
-    else:
-        webhook_event = existing_event
-
-    # Process event based on type
-    try:
-        event_handlers = {
-            'checkout.session.completed': WebhookHandler.handle_checkout_completed,
-            'customer.subscription.updated': WebhookHandler.handle_subscription_updated,
-            'customer.subscription.deleted': WebhookHandler.handle_subscription_deleted,
-            'invoice.paid': WebhookHandler.handle_invoice_paid,
-            'invoice.payment_failed': WebhookHandler.handle_invoice_payment_failed,
-        }
-
-        handler = event_handlers.get(event['type'])
-        if handler:
-            handler(event['data'], db)
+    # Record the event (idempotency) with its payload, which outlives the Redis
+    # staging copy if the worker falls behind; a redelivery conflicts and returns no row
+    webhook_event_id = await db.scalar(
+        pg_insert(StripeWebhookEvent)
+        .values(stripe_event_id=event['id'], event_type=event['type'], payload=payload.decode())
+        .on_conflict_do_nothing(index_elements=[StripeWebhookEvent.stripe_event_id])
+        .returning(StripeWebhookEvent.id)
+    )
+
+    if webhook_event_id is None:
+        webhook_event_id, processed = (await db.execute(
+            select(StripeWebhookEvent.id, StripeWebhookEvent.processed).where(
+                StripeWebhookEvent.stripe_event_id == event['id']
+            )
+        )).one()
 
-        # Mark as processed
-        webhook_event.processed = True
-        webhook_event.processed_at = datetime.utcnow()
-        db.commit()
+        if processed:
+            return {"status": "already_processed"}
 
-        return {"status": "success"}
+    await db.commit()
 
+    # Stage and publish before acknowledging; the worker runs the handler and marks
+    # the event processed
+    try:
+        await async_redis_client.setex(stripe_event_key(event['id']), STRIPE_EVENT_TTL, payload)
+        await asyncio.to_thread(process_stripe_event.delay, event['id'])
     except Exception as e:
-        webhook_event.processing_error = str(e)
-        db.commit()
+        logger.error(f"Failed to queue Stripe event {event['id']}: {e}")
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Webhook processing failed: {str(e)}"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to queue event"
         )
 
+    return {"status": "queued"}
+
@@ -2,7 +2,8 @@
 SQLAlchemy Database Models
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -28,10 +29,10 @@ class User(Base):
 
     # Voice Analysis
     detected_niche = Column(String, nullable=True)
-    voice_profile = Column(JSON, nullable=True)  # AI-analyzed writing style
+    voice_profile = Column(JSONB, nullable=True)  # AI-analyzed writing style
     # Structure: {"niche": ["AI", "coding"], "tone": "technical", "topics": [...], "best_content": [...]}
     analysis_complete = Column(Boolean, default=False)
-    best_posting_times = Column(JSON, nullable=True)  # Optimal posting times based on engagement
+    best_posting_times = Column(JSONB, nullable=True)  # Optimal posting times based on engagement
 
     # Settings
     auto_pilot_enabled = Column(Boolean, default=False)
@@ -47,6 +48,15 @@ class User(Base):
     scheduled_posts = relationship("ScheduledPost", back_populates="user")
     subscription = relationship("Subscription", back_populates="user", uselist=False)
 
+    __table_args__ = (
+        # Niche lookups: voice_profile->'niche' @> '["AI"]'
+        Index(
+            "ix_users_voice_profile_niche",
+            voice_profile["niche"],
+            postgresql_using="gin"
+        ),
+    )
+
     @property
     def is_pro(self) -> bool:
         """Check if user has active Pro subscription"""
@@ -62,7 +72,7 @@ class Post(Base):
     __tablename__ = "posts"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     # X Post Data
     x_post_id = Column(String, unique=True, index=True)
@@ -70,7 +80,7 @@ class Post(Base):
     content = Column(Text)
     engagement_score = Column(Integer)  # likes + retweets + replies
     detected_niche = Column(String)
-    source_tweet_stats = Column(JSON, nullable=True)  # Full engagement metrics
+    source_tweet_stats = Column(JSONB, nullable=True)  # Full engagement metrics
     # Structure: {"views": 150000, "likes": 2000, "retweets": 500, "timestamp": "..."}
 
     # AI Remix
@@ -88,6 +98,9 @@ class Post(Base):
     # Relationships
     user = relationship("User", back_populates="posts")
 
+    # Fetch server defaults with INSERT ... RETURNING instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class ScheduledPost(Base):
     """
@@ -105,7 +118,8 @@ class ScheduledPost(Base):
     # Scheduling
     scheduled_for = Column(DateTime(timezone=True))
     posted_at = Column(DateTime(timezone=True), nullable=True)
-    status = Column(String, default="pending")  # pending, posted, failed
+    status = Column(String, default="pending")  # pending, dispatched, posted, failed
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)  # When process_scheduled_posts queued it
 
     # X Response
     x_post_id = Column(String, nullable=True)
@@ -117,6 +131,30 @@ class ScheduledPost(Base):
     # Relationships
     user = relationship("User", back_populates="scheduled_posts")
 
+    __table_args__ = (
+        # Due-post dispatch: WHERE status = 'pending' AND scheduled_for <= now ORDER BY scheduled_for.
+        # Partial, so it only holds the (small) pending backlog rather than every posted row
+        Index(
+            "ix_scheduled_posts_pending_scheduled_for",
+            "scheduled_for",
+            postgresql_where=status == "pending"
+        ),
+        # Stale-dispatch reclaim: WHERE status = 'dispatched' AND dispatched_at < ?
+        Index(
+            "ix_scheduled_posts_dispatched_dispatched_at",
+            "dispatched_at",
+            postgresql_where=status == "dispatched"
+        ),
+        # Per-user queue/analytics: WHERE user_id = ? AND status IN (...) ORDER BY scheduled_for DESC
+        Index("ix_scheduled_posts_user_id_status_scheduled_for", "user_id", "status", scheduled_for.desc()),
+        # Analytics: WHERE user_id = ? AND status = 'posted' AND x_post_id IS NOT NULL ORDER BY posted_at DESC
+        Index(
+            "ix_scheduled_posts_user_id_status_posted_at",
+            "user_id", "status", posted_at.desc(),
+            postgresql_where=x_post_id.isnot(None)
+        ),
+    )
+
 
 class Subscription(Base):
     """
@@ -139,6 +177,7 @@ class Subscription(Base):
     current_period_end = Column(DateTime(timezone=True), nullable=True)
     cancel_at_period_end = Column(Boolean, default=False)
     canceled_at = Column(DateTime(timezone=True), nullable=True)
+    last_stripe_event_at = Column(DateTime(timezone=True), nullable=True)  # `created` of the last applied subscription event
 
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -148,6 +187,9 @@ class Subscription(Base):
     user = relationship("User", back_populates="subscription")
     payment_history = relationship("PaymentHistory", back_populates="subscription")
 
+    # Fetch server defaults with INSERT ... RETURNING instead of a refresh
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class PaymentHistory(Base):
     """
@@ -179,6 +221,11 @@ class PaymentHistory(Base):
     # Relationships
     subscription = relationship("Subscription", back_populates="payment_history")
 
+    __table_args__ = (
+        # Billing history: WHERE subscription_id = ? ORDER BY created_at DESC
+        Index("ix_payment_history_subscription_id_created_at", "subscription_id", created_at.desc()),
+    )
+
 
 class StripeWebhookEvent(Base):
     """
@@ -189,6 +236,7 @@ class StripeWebhookEvent(Base):
     id = Column(Integer, primary_key=True, index=True)
     stripe_event_id = Column(String, unique=True, index=True)
     event_type = Column(String)
+    payload = Column(Text, nullable=True)  # Raw event JSON, used once the Redis staging copy expires
     processed = Column(Boolean, default=False)
     processing_error = Column(Text, nullable=True)
 
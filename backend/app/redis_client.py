@@ -2,142 +2,297 @@
 Redis client for caching and rate limiting
 """
 
+import orjson
 import redis
-from typing import Optional
+import redis.asyncio as aioredis
+import secrets
+import time
+from typing import Dict, List
 from app.database import settings
 
-# Global Redis client
-redis_client = redis.from_url(
+# Shared, bounded connection pool; callers wait up to 5s for a free connection
+# instead of opening sockets without limit
+redis_pool = redis.BlockingConnectionPool.from_url(
     settings.redis_url,
+    max_connections=settings.redis_pool_size,
+    timeout=5,
     decode_responses=True,
     socket_connect_timeout=5,
     socket_keepalive=True
 )
 
+# Global Redis client (Celery workers and other sync code)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Async client for FastAPI handlers and LLM caching, so a Redis round trip
+# yields to the event loop instead of blocking every request on the worker
+async_redis_pool = aioredis.BlockingConnectionPool.from_url(
+    settings.redis_url,
+    max_connections=settings.redis_pool_size,
+    timeout=5,
+    decode_responses=True,
+    socket_connect_timeout=5,
+    socket_keepalive=True
+)
+async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
+
+
+async def close_async_redis() -> None:
+    """Close the async Redis client's connections (call on app shutdown)"""
+    await async_redis_client.aclose()
+
+
+# INCR the window counter, start its TTL on the first hit, and report the result
+# in one round trip: {allowed (1/0), count, ttl}
+_HIT_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+local ttl = redis.call('TTL', KEYS[1])
+if count > tonumber(ARGV[1]) then
+    return {0, count, ttl}
+end
+return {1, count, ttl}
+"""
+
+# Sliding window over a sorted set of request timestamps (ms): drop entries older
+# than the window, then admit and record the request if there is room.
+# Returns {allowed (1/0), count, ms until the oldest entry leaves the window}
+_SLIDING_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return {1, count + 1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, count, tonumber(oldest[2]) + window - now}
+"""
+
 
 class RateLimiter:
     """
-    Rate limiting using Redis counters with TTL
+    Rate limiting using Redis sliding windows
     """
 
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
+        self._sliding = redis_client.register_script(_SLIDING_SCRIPT)
 
-    def check_rate_limit(self, key: str, limit: int, window_seconds: int = 900) -> tuple[bool, int]:
+    def sliding_check(self, key: str, limit: int, window_seconds: int = 900) -> tuple[bool, int, int]:
         """
-        Check if rate limit is exceeded
+        Atomically check and record a request against a sliding window
+
+        Unlike a fixed window counter, a burst straddling a window boundary
+        can't get through twice the limit.
 
         Args:
-            key: Redis key (e.g., "rate_limit:user_123:posts")
-            limit: Max requests allowed
-            window_seconds: Time window in seconds (default 900 = 15 min)
+            key: Redis key for the user's sorted set of request timestamps
+            limit: Max requests allowed in any window_seconds span
+            window_seconds: Window length in seconds (default 900 = 15 min)
 
         Returns:
-            (allowed: bool, current_count: int)
+            (allowed: bool, count: int, reset_in_seconds: int) where
+            reset_in is when the next slot frees up, or -1 if allowed
         """
-        current = self.redis.get(key)
+        now_ms = int(time.time() * 1000)
+        allowed, count, reset_in_ms = self._sliding(
+            keys=[key],
+            args=[now_ms, window_seconds * 1000, limit, f"{now_ms}-{secrets.token_hex(4)}"]
+        )
 
-        if current is None:
-            # First request in window
-            return True, 0
+        if allowed:
+            return True, count, -1
+        return False, count, max(1, -(-reset_in_ms // 1000))
 
-        current_count = int(current)
 
-        if current_count >= limit:
-            # Rate limit exceeded
-            return False, current_count
+# Global rate limiter instance
+rate_limiter = RateLimiter(redis_client)
 
-        # Within limit
-        return True, current_count
 
-    def increment_rate_limit(self, key: str, window_seconds: int = 900) -> int:
-        """
-        Increment rate limit counter
+# X API Rate Limit Constants
+X_API_POST_LIMIT = 100  # tweets per 15 minutes
+X_API_WINDOW = 900  # 15 minutes in seconds
 
-        Args:
-            key: Redis key
-            window_seconds: TTL for the key
 
-        Returns:
-            New count value
-        """
-        pipe = self.redis.pipeline()
-        pipe.incr(key)
-        pipe.expire(key, window_seconds)
-        results = pipe.execute()
+def check_x_post_rate_limit(user_id: int) -> tuple[bool, int, int]:
+    """
+    Reserve one post against a user's X API post rate limit
 
-        return results[0]  # Return new count
+    Sliding 15-minute window; the check and the reservation are a single atomic
+    Redis call, so concurrent workers can't both take the last slot.
 
-    def get_remaining(self, key: str, limit: int) -> int:
-        """
-        Get remaining requests in current window
+    Args:
+        user_id: User ID
 
-        Args:
-            key: Redis key
-            limit: Max requests allowed
+    Returns:
+        (allowed: bool, remaining: int, reset_in_seconds: int), reset_in is -1 if allowed
+    """
+    key = f"rate_limit:user_{user_id}:x_posts_window"
+    allowed, count, reset_in = rate_limiter.sliding_check(key, X_API_POST_LIMIT, X_API_WINDOW)
+    remaining = max(0, X_API_POST_LIMIT - count)
 
-        Returns:
-            Remaining requests (0 if limit exceeded)
-        """
-        current = self.redis.get(key)
-        if current is None:
-            return limit
+    return allowed, remaining, reset_in
 
-        current_count = int(current)
-        remaining = limit - current_count
 
-        return max(0, remaining)
+# Stripe-backed billing actions per user per minute
+STRIPE_ACTION_LIMIT = 5
+STRIPE_ACTION_WINDOW = 60
 
-    def get_ttl(self, key: str) -> Optional[int]:
-        """
-        Get time remaining until rate limit resets
 
-        Args:
-            key: Redis key
+_async_hit = async_redis_client.register_script(_HIT_SCRIPT)
 
-        Returns:
-            Seconds until reset, or None if key doesn't exist
-        """
-        ttl = self.redis.ttl(key)
-        return ttl if ttl > 0 else None
 
+async def check_stripe_action_rate_limit(user_id: int) -> bool:
+    """
+    Count a billing action that calls Stripe against the user's per-minute budget
 
-# Global rate limiter instance
-rate_limiter = RateLimiter(redis_client)
+    Uses a fixed one-minute window keyed by the minute, so a single atomic INCR
+    is correct across all API workers.
 
+    Args:
+        user_id: User ID
 
-# X API Rate Limit Constants
-X_API_POST_LIMIT = 100  # tweets per 15 minutes
-X_API_WINDOW = 900  # 15 minutes in seconds
+    Returns:
+        True if the action is allowed
+    """
+    window = int(time.time() // STRIPE_ACTION_WINDOW)
+    key = f"rate_limit:user_{user_id}:stripe:{window}"
+    allowed, _, _ = await _async_hit(keys=[key], args=[STRIPE_ACTION_LIMIT, STRIPE_ACTION_WINDOW * 2])
+
+    return bool(allowed)
+
+
+# Cached User rows for get_current_user (seconds)
+USER_CACHE_TTL = 60
+
+
+def user_cache_key(user_id: int) -> str:
+    """Redis key for a user's cached row"""
+    return f"user:{user_id}"
 
 
-def check_x_post_rate_limit(user_id: int) -> tuple[bool, int, Optional[int]]:
+def invalidate_cached_user(user_id: int) -> None:
     """
-    Check X API post rate limit for a user
+    Drop a user's cached row after the user or their subscription changes
 
     Args:
         user_id: User ID
+    """
+    try:
+        redis_client.delete(user_cache_key(user_id))
+    except redis.RedisError:
+        # The entry still expires after USER_CACHE_TTL
+        pass
+
+
+async def ainvalidate_cached_user(user_id: int) -> None:
+    """
+    Async invalidate_cached_user() for request handlers
+
+    Args:
+        user_id: User ID
+    """
+    try:
+        await async_redis_client.delete(user_cache_key(user_id))
+    except redis.RedisError:
+        pass
+
+
+# Verified Stripe webhook payloads awaiting process_stripe_event (seconds)
+STRIPE_EVENT_TTL = 3600
+
+
+def stripe_event_key(event_id: str) -> str:
+    """Redis key for a staged Stripe webhook payload"""
+    return f"stripe_event:{event_id}"
+
+
+# Processed Stripe event IDs, so redeliveries are answered without touching the DB (seconds)
+STRIPE_EVENT_DEDUPE_TTL = 86400
+
+
+def mark_stripe_event_processed(event_id: str) -> None:
+    """
+    Remember a processed Stripe event and drop its staged payload
+
+    Args:
+        event_id: Stripe event ID (evt_...)
+    """
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(f"stripe:evt:{event_id}", "1", ex=STRIPE_EVENT_DEDUPE_TTL)
+        pipe.delete(stripe_event_key(event_id))
+        pipe.execute()
+    except redis.RedisError:
+        # The DB processed flag still dedupes
+        pass
+
+
+async def is_stripe_event_processed(event_id: str) -> bool:
+    """
+    Check whether a Stripe event was processed in the last 24 hours
+
+    Args:
+        event_id: Stripe event ID (evt_...)
 
     Returns:
-        (allowed: bool, remaining: int, reset_in_seconds: Optional[int])
+        True if it was; False if unknown or Redis is unavailable
     """
-    key = f"rate_limit:user_{user_id}:x_posts"
-    allowed, current = rate_limiter.check_rate_limit(key, X_API_POST_LIMIT, X_API_WINDOW)
-    remaining = X_API_POST_LIMIT - current
-    reset_in = rate_limiter.get_ttl(key) if not allowed else None
+    try:
+        return bool(await async_redis_client.exists(f"stripe:evt:{event_id}"))
+    except redis.RedisError:
+        return False
 
-    return allowed, remaining, reset_in
 
+# Cached X tweet metrics for the analytics page (seconds)
+X_METRICS_CACHE_TTL = 300
 
-def increment_x_post_count(user_id: int) -> int:
+
+async def get_cached_tweet_metrics(tweet_ids: List[str]) -> Dict[str, Dict]:
     """
-    Increment X API post counter for a user
+    Look up cached X metrics for many tweets in one MGET
 
     Args:
-        user_id: User ID
+        tweet_ids: X tweet IDs
 
     Returns:
-        New count
+        {tweet_id: metrics} for the IDs that were cached
+    """
+    if not tweet_ids:
+        return {}
+
+    try:
+        cached = await async_redis_client.mget([f"xmetrics:{tweet_id}" for tweet_id in tweet_ids])
+    except redis.RedisError:
+        return {}
+
+    return {
+        tweet_id: orjson.loads(value)
+        for tweet_id, value in zip(tweet_ids, cached)
+        if value is not None
+    }
+
+
+async def cache_tweet_metrics(metrics_by_id: Dict[str, Dict]) -> None:
+    """
+    Cache X metrics per tweet for X_METRICS_CACHE_TTL
+
+    Args:
+        metrics_by_id: {tweet_id: metrics} from the X API
     """
-    key = f"rate_limit:user_{user_id}:x_posts"
-    return rate_limiter.increment_rate_limit(key, X_API_WINDOW)
+    if not metrics_by_id:
+        return
+
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        for tweet_id, metrics in metrics_by_id.items():
+            pipe.setex(f"xmetrics:{tweet_id}", X_METRICS_CACHE_TTL, orjson.dumps(metrics))
+        await pipe.execute()
+    except redis.RedisError:
+        pass
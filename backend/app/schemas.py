@@ -2,8 +2,8 @@
 Pydantic schemas for request/response validation
 """
 
-from pydantic import BaseModel, EmailStr
-from typing import Optional, Dict
+from pydantic import BaseModel, ConfigDict, EmailStr
+from typing import Any, Optional, Dict
 from datetime import datetime
 
 
@@ -25,8 +25,7 @@ class UserResponse(BaseModel):
     preferred_ai_model: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class Token(BaseModel):
@@ -47,8 +46,7 @@ class PostResponse(BaseModel):
     ai_model_used: Optional[str]
     discovered_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class RemixRequest(BaseModel):
@@ -78,12 +76,11 @@ class ScheduledPostResponse(BaseModel):
     x_post_id: Optional[str]
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Voice Analysis Schema
 class VoiceAnalysisResponse(BaseModel):
     niche: str
-    voice_profile: Dict
+    voice_profile: Dict[str, Any]
     sample_tweets_analyzed: int
@@ -3,13 +3,20 @@ Stripe Service
 Handles Stripe API operations for subscriptions and payments
 """
 
+import hashlib
+import orjson
+import redis
 import stripe
 from app.database import settings
 from app.models import User, Subscription
+from app.redis_client import redis_client
 from typing import Dict
 
 stripe.api_key = settings.stripe_secret_key
 
+# Customer IDs by user, matching Stripe's 24h idempotency key window (seconds)
+STRIPE_CUSTOMER_CACHE_TTL = 86400
+
 
 class StripeService:
     """Service for Stripe API interactions"""
@@ -19,20 +26,42 @@ class StripeService:
         """
         Create Stripe customer for user
 
+        Idempotent per user and params: repeated or concurrent calls (e.g. a
+        double-clicked checkout) return the same customer instead of creating duplicates.
+
         Args:
             user: User model instance
 
         Returns:
             Stripe customer ID
         """
-        customer = stripe.Customer.create(
-            email=user.email if user.email else None,
-            metadata={
+        cache_key = f"stripe:cust:user:{user.id}"
+        try:
+            cached = redis_client.get(cache_key)
+        except redis.RedisError:
+            cached = None
+        if cached:
+            return cached
+
+        params = {
+            "email": user.email if user.email else None,
+            "metadata": {
                 "user_id": user.id,
                 "username": user.username,
                 "x_username": user.x_username
             }
-        )
+        }
+
+        # Key derived from the params: same request -> same customer, while a changed
+        # email/username gets a new key instead of Stripe's param-mismatch error
+        params_digest = hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()[:32]
+        customer = stripe.Customer.create(**params, idempotency_key=f"cust-{user.id}-{params_digest}")
+
+        try:
+            redis_client.setex(cache_key, STRIPE_CUSTOMER_CACHE_TTL, customer.id)
+        except redis.RedisError:
+            pass
+
         return customer.id
 
     @staticmethod
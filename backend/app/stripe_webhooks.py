@@ -4,165 +4,272 @@ Process Stripe webhook events
 """
 
 from app.models import Subscription, PaymentHistory
+from sqlalchemy import literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _from_stripe_ts(ts: int) -> datetime:
+    """
+    Convert a Stripe Unix timestamp to an aware UTC datetime
+
+    Naive fromtimestamp() would use the worker's local timezone, which
+    timestamptz columns then misread as the DB session's timezone.
+    """
+    return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+
 class WebhookHandler:
-    """Handlers for Stripe webhook events"""
+    """
+    Handlers for Stripe webhook events
+
+    Each handler writes with UPDATE/INSERT ... RETURNING (one round trip, no
+    separate lookup) and leaves the commit to the caller, so the handler's writes
+    and the event's processed flag land in the same transaction. Handlers return
+    the ID of the user whose cached row must be dropped after commit, if any.
+    """
 
     @staticmethod
-    def handle_checkout_completed(event_data: dict, db: Session):
+    def handle_checkout_completed(event: dict, db: Session) -> Optional[int]:
         """
         Handle checkout.session.completed event
         Activates subscription after successful checkout
 
         Args:
-            event_data: Stripe event data
+            event: Stripe event
             db: Database session
+
+        Returns:
+            User ID whose subscription changed, or None
         """
-        session = event_data['object']
+        session = event['data']['object']
         subscription_id = session['metadata'].get('subscription_id')
 
-        if subscription_id:
-            subscription = db.query(Subscription).filter(
-                Subscription.id == int(subscription_id)
-            ).first()
+        if not subscription_id:
+            return None
+
+        user_id = db.scalar(
+            update(Subscription)
+            .where(Subscription.id == int(subscription_id))
+            .values(stripe_subscription_id=session['subscription'], status='active')
+            .returning(Subscription.user_id)
+        )
+
+        if user_id is not None:
+            logger.info(f"Activated subscription {subscription_id} for user {user_id}")
 
-            if subscription:
-                subscription.stripe_subscription_id = session['subscription']
-                subscription.status = 'active'
-                db.commit()
-                logger.info(f"Activated subscription {subscription.id} for user {subscription.user_id}")
+        return user_id
 
     @staticmethod
-    def handle_subscription_updated(event_data: dict, db: Session):
+    def handle_subscription_updated(event: dict, db: Session) -> Optional[int]:
         """
         Handle customer.subscription.updated event
         Syncs subscription status changes from Stripe
 
         Args:
-            event_data: Stripe event data
+            event: Stripe event
             db: Database session
+
+        Returns:
+            User ID whose subscription changed, or None
         """
-        stripe_sub = event_data['object']
+        stripe_sub = event['data']['object']
 
-        subscription = db.query(Subscription).filter(
-            Subscription.stripe_subscription_id == stripe_sub['id']
-        ).first()
+        event_at = _from_stripe_ts(event['created'])
 
-        if subscription:
-            subscription.status = stripe_sub['status']
-            subscription.current_period_start = datetime.fromtimestamp(
-                stripe_sub['current_period_start']
-            )
-            subscription.current_period_end = datetime.fromtimestamp(
-                stripe_sub['current_period_end']
+        values = {
+            "last_stripe_event_at": event_at,
+            "status": stripe_sub['status'],
+            "current_period_start": _from_stripe_ts(stripe_sub['current_period_start']),
+            "current_period_end": _from_stripe_ts(stripe_sub['current_period_end']),
+            "cancel_at_period_end": stripe_sub['cancel_at_period_end'],
+        }
+
+        # Update plan type based on status
+        if stripe_sub['status'] == 'active':
+            values["plan_type"] = 'pro'
+        elif stripe_sub['status'] in ['canceled', 'unpaid']:
+            values["plan_type"] = 'free'
+
+        # Stripe delivers out of order; ignore an update older than one already applied.
+        # created has 1s resolution, so same-second events still apply (replays are
+        # already deduped by event ID)
+        row = db.execute(
+            update(Subscription)
+            .where(
+                Subscription.stripe_subscription_id == stripe_sub['id'],
+                or_(
+                    Subscription.last_stripe_event_at.is_(None),
+                    Subscription.last_stripe_event_at <= event_at
+                )
             )
-            subscription.cancel_at_period_end = stripe_sub['cancel_at_period_end']
+            .values(**values)
+            .returning(Subscription.id, Subscription.user_id)
+        ).first()
 
-            # Update plan type based on status
-            if stripe_sub['status'] == 'active':
-                subscription.plan_type = 'pro'
-            elif stripe_sub['status'] in ['canceled', 'unpaid']:
-                subscription.plan_type = 'free'
+        if row is None:
+            logger.info(f"Skipped stale or unknown subscription update {event['id']}")
+            return None
 
-            db.commit()
-            logger.info(f"Updated subscription {subscription.id} status to {stripe_sub['status']}")
+        logger.info(f"Updated subscription {row.id} status to {stripe_sub['status']}")
+        return row.user_id
 
     @staticmethod
-    def handle_subscription_deleted(event_data: dict, db: Session):
+    def handle_subscription_deleted(event: dict, db: Session) -> Optional[int]:
         """
         Handle customer.subscription.deleted event
         Marks subscription as canceled
 
         Args:
-            event_data: Stripe event data
+            event: Stripe event
             db: Database session
+
+        Returns:
+            User ID whose subscription changed, or None
         """
-        stripe_sub = event_data['object']
+        stripe_sub = event['data']['object']
 
-        subscription = db.query(Subscription).filter(
-            Subscription.stripe_subscription_id == stripe_sub['id']
+        row = db.execute(
+            update(Subscription)
+            .where(Subscription.stripe_subscription_id == stripe_sub['id'])
+            .values(
+                status='canceled',
+                plan_type='free',
+                canceled_at=datetime.utcnow(),
+                last_stripe_event_at=_from_stripe_ts(event['created'])
+            )
+            .returning(Subscription.id, Subscription.user_id)
         ).first()
 
-        if subscription:
-            subscription.status = 'canceled'
-            subscription.plan_type = 'free'
-            subscription.canceled_at = datetime.utcnow()
-            db.commit()
-            logger.info(f"Canceled subscription {subscription.id}")
+        if row is None:
+            return None
+
+        logger.info(f"Canceled subscription {row.id}")
+        return row.user_id
 
     @staticmethod
-    def handle_invoice_paid(event_data: dict, db: Session):
+    def handle_invoice_paid(event: dict, db: Session) -> Optional[int]:
         """
         Handle invoice.paid event
         Records successful payment in history
 
         Args:
-            event_data: Stripe event data
+            event: Stripe event
             db: Database session
+
+        Returns:
+            None (the subscription row is unchanged)
         """
-        invoice = event_data['object']
+        invoice = event['data']['object']
 
         if not invoice.get('subscription'):
-            return
+            return None
 
-        subscription = db.query(Subscription).filter(
-            Subscription.stripe_subscription_id == invoice['subscription']
-        ).first()
+        description = f"Payment for {invoice['lines']['data'][0]['description']}" if invoice.get('lines') else "Subscription payment"
+        paid_at = _from_stripe_ts(invoice['status_transitions']['paid_at']) if invoice.get('status_transitions') else datetime.utcnow()
 
-        if subscription:
-            payment = PaymentHistory(
-                subscription_id=subscription.id,
-                stripe_payment_intent_id=invoice['payment_intent'],
-                stripe_invoice_id=invoice['id'],
-                amount=invoice['amount_paid'],
-                currency=invoice['currency'],
-                status='succeeded',
-                description=f"Payment for {invoice['lines']['data'][0]['description']}" if invoice.get('lines') else "Subscription payment",
-                paid_at=datetime.fromtimestamp(invoice['status_transitions']['paid_at']) if invoice.get('status_transitions') else datetime.utcnow()
-            )
-            db.add(payment)
-            db.commit()
-            logger.info(f"Recorded payment for subscription {subscription.id}")
+        # INSERT ... SELECT: resolve the subscription and record the payment in one statement.
+        # One row per invoice: a retry that succeeds after invoice.payment_failed
+        # turns the failed row into the successful payment
+        stmt = pg_insert(PaymentHistory).from_select(
+            [
+                "subscription_id", "stripe_payment_intent_id", "stripe_invoice_id",
+                "amount", "currency", "status", "description", "paid_at"
+            ],
+            select(
+                Subscription.id,
+                literal(invoice['payment_intent'], PaymentHistory.stripe_payment_intent_id.type),
+                literal(invoice['id'], PaymentHistory.stripe_invoice_id.type),
+                literal(invoice['amount_paid'], PaymentHistory.amount.type),
+                literal(invoice['currency'], PaymentHistory.currency.type),
+                literal('succeeded', PaymentHistory.status.type),
+                literal(description, PaymentHistory.description.type),
+                literal(paid_at, PaymentHistory.paid_at.type),
+            ).where(Subscription.stripe_subscription_id == invoice['subscription'])
+        )
+        subscription_id = db.scalar(
+            stmt.on_conflict_do_update(
+                index_elements=[PaymentHistory.stripe_invoice_id],
+                set_={
+                    "stripe_payment_intent_id": stmt.excluded.stripe_payment_intent_id,
+                    "amount": stmt.excluded.amount,
+                    "status": stmt.excluded.status,
+                    "description": stmt.excluded.description,
+                    "paid_at": stmt.excluded.paid_at,
+                    "failure_reason": None,
+                }
+            ).returning(PaymentHistory.subscription_id)
+        )
+
+        if subscription_id is not None:
+            logger.info(f"Recorded payment for subscription {subscription_id}")
+
+        return None
 
     @staticmethod
-    def handle_invoice_payment_failed(event_data: dict, db: Session):
+    def handle_invoice_payment_failed(event: dict, db: Session) -> Optional[int]:
         """
         Handle invoice.payment_failed event
         Records failed payment and updates subscription status
 
         Args:
-            event_data: Stripe event data
+            event: Stripe event
             db: Database session
+
+        Returns:
+            User ID whose subscription changed, or None
         """
-        invoice = event_data['object']
+        invoice = event['data']['object']
 
         if not invoice.get('subscription'):
-            return
+            return None
 
-        subscription = db.query(Subscription).filter(
-            Subscription.stripe_subscription_id == invoice['subscription']
+        # Update subscription status
+        row = db.execute(
+            update(Subscription)
+            .where(Subscription.stripe_subscription_id == invoice['subscription'])
+            .values(status='past_due')
+            .returning(Subscription.id, Subscription.user_id)
         ).first()
 
-        if subscription:
-            # Update subscription status
-            subscription.status = 'past_due'
-
-            # Record failed payment
-            payment = PaymentHistory(
-                subscription_id=subscription.id,
-                stripe_invoice_id=invoice['id'],
-                amount=invoice['amount_due'],
-                currency=invoice['currency'],
-                status='failed',
-                failure_reason=invoice.get('last_finalization_error', {}).get('message', 'Payment failed'),
-                description=f"Failed payment for {invoice['lines']['data'][0]['description']}" if invoice.get('lines') else "Subscription payment"
+        if row is None:
+            return None
+
+        # Record failed payment (later failed attempts on the same invoice update it)
+        stmt = pg_insert(PaymentHistory).values(
+            subscription_id=row.id,
+            stripe_invoice_id=invoice['id'],
+            amount=invoice['amount_due'],
+            currency=invoice['currency'],
+            status='failed',
+            failure_reason=invoice.get('last_finalization_error', {}).get('message', 'Payment failed'),
+            description=f"Failed payment for {invoice['lines']['data'][0]['description']}" if invoice.get('lines') else "Subscription payment"
+        )
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[PaymentHistory.stripe_invoice_id],
+                set_={
+                    "amount": stmt.excluded.amount,
+                    "failure_reason": stmt.excluded.failure_reason,
+                },
+                where=PaymentHistory.status == 'failed'
             )
-            db.add(payment)
-            db.commit()
-            logger.warning(f"Payment failed for subscription {subscription.id}")
+        )
+
+        logger.warning(f"Payment failed for subscription {row.id}")
+        return row.user_id
+
+
+# Stripe event type -> handler; other event types are recorded but ignored
+EVENT_HANDLERS = {
+    'checkout.session.completed': WebhookHandler.handle_checkout_completed,
+    'customer.subscription.updated': WebhookHandler.handle_subscription_updated,
+    'customer.subscription.deleted': WebhookHandler.handle_subscription_deleted,
+    'invoice.paid': WebhookHandler.handle_invoice_paid,
+    'invoice.payment_failed': WebhookHandler.handle_invoice_payment_failed,
+}
@@ -4,13 +4,129 @@ OAuth 2.0 authentication and API calls
 """
 
 import tweepy
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import functools
+import heapq
+import operator
+import orjson
+import redis
 from typing import List, Dict, Optional
 from datetime import datetime
 import logging
 from app.database import settings
+from app.redis_client import redis_client, X_METRICS_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
+X_API_BASE_URL = "https://api.twitter.com/2"
+
+# Recent-search query for original English tweets in a niche. v2 search has no
+# min_faves/min_retweets operators, so searches ask for relevancy ordering (which
+# favours high-engagement tweets) and the engagement floor is applied client-side
+VIRAL_SEARCH_QUERY = "{niche} -is:retweet -is:reply lang:en"
+
+# Most niches searched per call; each is a request against the app-wide search limit
+MAX_SEARCH_NICHES = 3
+
+# Shared async client for read endpoints (FastAPI routes and run_async in workers)
+_x_api_http = httpx.AsyncClient(
+    base_url=X_API_BASE_URL,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+    timeout=10.0,
+    http2=True
+)
+
+# Shared keep-alive pool for every tweepy.Client; tweepy otherwise opens a new
+# requests.Session (and TLS connection) per XAPIClient instance. Transient
+# gateway errors are retried on idempotent methods only (never create_tweet's POST)
+_tweepy_session = requests.Session()
+_tweepy_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False  # Hand the last 5xx back so tweepy raises its own error
+    )
+))
+
+
+def _redis_cached(prefix: str, ttl: int = 300):
+    """
+    Cache a single-ID lookup method in Redis as "<prefix>:<id>" for ttl seconds
+
+    Empty results (deleted/unknown IDs) are not cached. Redis errors fall back
+    to calling X.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, object_id: str) -> Dict:
+            key = f"{prefix}:{object_id}"
+
+            try:
+                cached = redis_client.get(key)
+            except redis.RedisError:
+                cached = None
+            if cached is not None:
+                return orjson.loads(cached)
+
+            result = method(self, object_id)
+
+            if result:
+                try:
+                    redis_client.setex(key, ttl, orjson.dumps(result))
+                except redis.RedisError:
+                    pass
+
+            return result
+        return wrapper
+    return decorator
+
+
+def _engagement(metrics: Dict) -> int:
+    """Likes + retweets, the viral-post threshold metric"""
+    return metrics.get("like_count", 0) + metrics.get("retweet_count", 0)
+
+
+_by_engagement = operator.itemgetter("engagement_score")
+
+
+def _viral_post(tweet_id, text: str, author_id, author_username: str, created_at: Optional[str], metrics: Dict) -> Dict:
+    """Build the viral post dict returned by the search methods"""
+    get = metrics.get
+    likes = get("like_count", 0)
+    retweets = get("retweet_count", 0)
+
+    return {
+        "id": tweet_id,
+        "text": text,
+        "author_id": author_id,
+        "author_username": author_username,
+        "created_at": created_at,
+        "engagement_score": likes + retweets,
+        "metrics": {
+            "likes": likes,
+            "retweets": retweets,
+            "replies": get("reply_count", 0),
+            "views": get("impression_count", 0)
+        }
+    }
+
+
+def split_niches(niche: str) -> List[str]:
+    """Split a detected_niche string ("AI, coding") into individual search terms"""
+    return [part.strip() for part in niche.split(",") if part.strip()]
+
+
+async def close_x_api_http() -> None:
+    """Close the shared X API HTTP client (call on app shutdown)"""
+    await _x_api_http.aclose()
+
 
 class XAPIClient:
     """
@@ -24,6 +140,8 @@ class XAPIClient:
         Args:
             access_token: User's OAuth access token (for authenticated requests)
         """
+        self.access_token = access_token
+
         if access_token:
             # OAuth 2.0 user context
             self.client = tweepy.Client(
@@ -34,6 +152,8 @@ class XAPIClient:
             # App-only authentication (read-only)
             self.client = tweepy.Client(bearer_token=settings.x_bearer_token)
 
+        self.client.session = _tweepy_session
+
 
     def get_user_tweets(self, user_id: str, max_results: int = 100) -> List[Dict]:
         """
@@ -60,14 +180,15 @@ class XAPIClient:
 
             tweets = []
             for tweet in response.data:
+                metrics = tweet.public_metrics
                 tweets.append({
                     "id": tweet.id,
                     "text": tweet.text,
                     "created_at": tweet.created_at.isoformat() if tweet.created_at else None,
                     "metrics": {
-                        "likes": tweet.public_metrics.get("like_count", 0),
-                        "retweets": tweet.public_metrics.get("retweet_count", 0),
-                        "replies": tweet.public_metrics.get("reply_count", 0),
+                        "likes": metrics.get("like_count", 0),
+                        "retweets": metrics.get("retweet_count", 0),
+                        "replies": metrics.get("reply_count", 0),
                     }
                 })
 
@@ -78,10 +199,40 @@ class XAPIClient:
             raise
 
 
+    def get_user_tweet_texts(self, user_id: str, max_results: int = 100) -> List[str]:
+        """
+        Fetch the text of a user's recent original tweets
+        Used for voice analysis, which needs nothing else
+
+        Args:
+            user_id: X user ID
+            max_results: Number of tweets to fetch (max 100)
+
+        Returns:
+            Tweet texts, newest first
+        """
+        try:
+            response = self.client.get_users_tweets(
+                id=user_id,
+                max_results=min(max_results, 100),
+                exclude=["retweets", "replies"]  # Only original tweets
+            )
+
+            return [tweet.text for tweet in response.data or []]
+
+        except tweepy.TweepyException as e:
+            logger.error(f"Error fetching user tweets: {e}")
+            raise
+
+
     def search_viral_posts(self, niche: str, min_engagement: int = 100, max_results: int = 50) -> List[Dict]:
         """
         Search for viral posts in a specific niche
 
+        Sync wrapper over asearch_viral_posts() for callers without an event
+        loop. Runs on its own short-lived HTTP client, since the shared one's
+        connections belong to the loop that opened them.
+
         Args:
             niche: Topic/hashtag to search
             min_engagement: Minimum likes + retweets
@@ -90,54 +241,85 @@ class XAPIClient:
         Returns:
             List of viral tweets with engagement metrics
         """
-        try:
-            # Build search query
-            query = f"{niche} -is:retweet -is:reply lang:en"
-
-            response = self.client.search_recent_tweets(
-                query=query,
-                max_results=max_results,
-                tweet_fields=["created_at", "public_metrics", "author_id"],
-                expansions=["author_id"],
-                user_fields=["username"]
-            )
+        async def search() -> List[Dict]:
+            async with httpx.AsyncClient(base_url=X_API_BASE_URL, timeout=10.0) as http:
+                return await self.asearch_viral_posts([niche], min_engagement, max_results, http=http)
 
-            if not response.data:
-                return []
+        return asyncio.run(search())
 
-            # Create username lookup
-            users = {user.id: user.username for user in response.includes.get("users", [])}
 
-            viral_posts = []
-            for tweet in response.data:
-                metrics = tweet.public_metrics
-                engagement = metrics.get("like_count", 0) + metrics.get("retweet_count", 0)
-
-                if engagement >= min_engagement:
-                    viral_posts.append({
-                        "id": tweet.id,
-                        "text": tweet.text,
-                        "author_id": tweet.author_id,
-                        "author_username": users.get(tweet.author_id, "unknown"),
-                        "created_at": tweet.created_at.isoformat() if tweet.created_at else None,
-                        "engagement_score": engagement,
-                        "metrics": {
-                            "likes": metrics.get("like_count", 0),
-                            "retweets": metrics.get("retweet_count", 0),
-                            "replies": metrics.get("reply_count", 0),
-                            "views": metrics.get("impression_count", 0)
-                        }
-                    })
-
-            # Sort by engagement
-            viral_posts.sort(key=lambda x: x["engagement_score"], reverse=True)
-
-            return viral_posts
+    async def asearch_viral_posts(
+        self,
+        niches: List[str],
+        min_engagement: int = 100,
+        max_results: int = 50,
+        http: Optional[httpx.AsyncClient] = None
+    ) -> List[Dict]:
+        """
+        Search for viral posts across several niches concurrently
 
-        except tweepy.TweepyException as e:
+        One recent-search request per niche, all in flight at once on the shared
+        async HTTP client, so wall time is the slowest niche rather than the sum.
+        Only the first MAX_SEARCH_NICHES niches are searched.
+
+        Args:
+            niches: Topics/hashtags to search
+            min_engagement: Minimum likes + retweets
+            max_results: Number of tweets to fetch per niche (and to return overall)
+            http: Client to send the searches on (defaults to the shared one)
+
+        Returns:
+            List of viral tweets with engagement metrics (IDs as strings),
+            deduplicated across niches
+        """
+        token = self.access_token or settings.x_bearer_token
+        per_niche = min(max(max_results, 10), 100)
+        niches = niches[:MAX_SEARCH_NICHES]
+        http = http or _x_api_http
+
+        try:
+            responses = await asyncio.gather(*(
+                http.get(
+                    "/tweets/search/recent",
+                    params={
+                        "query": VIRAL_SEARCH_QUERY.format(niche=niche),
+                        "max_results": per_niche,
+                        "sort_order": "relevancy",
+                        "tweet.fields": "created_at,public_metrics,author_id",
+                        "expansions": "author_id",
+                        "user.fields": "username"
+                    },
+                    headers={"Authorization": f"Bearer {token}"}
+                )
+                for niche in niches
+            ))
+            for response in responses:
+                response.raise_for_status()
+        except httpx.HTTPError as e:
             logger.error(f"Error searching viral posts: {e}")
             raise
 
+        viral_posts = {}
+        for response in responses:
+            payload = orjson.loads(response.content)
+            users = {user["id"]: user["username"] for user in payload.get("includes", {}).get("users", [])}
+
+            for tweet in payload.get("data", []):
+                metrics = tweet.get("public_metrics", {})
+
+                if _engagement(metrics) >= min_engagement and tweet["id"] not in viral_posts:
+                    viral_posts[tweet["id"]] = _viral_post(
+                        tweet["id"],
+                        tweet["text"],
+                        tweet.get("author_id"),
+                        users.get(tweet.get("author_id"), "unknown"),
+                        tweet.get("created_at"),
+                        metrics
+                    )
+
+        # Top max_results by engagement
+        return heapq.nlargest(max_results, viral_posts.values(), key=_by_engagement)
+
 
     def post_tweet(self, content: str) -> Dict:
         """
@@ -170,9 +352,11 @@ class XAPIClient:
             raise
 
 
+    @_redis_cached("xmetrics", ttl=X_METRICS_CACHE_TTL)
     def get_tweet_analytics(self, tweet_id: str) -> Dict:
         """
-        Get engagement metrics for a tweet
+        Get engagement metrics for a tweet (cached in Redis for 5 minutes,
+        shared with the analytics page's bulk lookups)
 
         Args:
             tweet_id: X tweet ID
@@ -193,7 +377,7 @@ class XAPIClient:
             metrics = tweet.public_metrics
 
             return {
-                "id": tweet.id,
+                "id": str(tweet.id),
                 "created_at": tweet.created_at.isoformat() if tweet.created_at else None,
                 "likes": metrics.get("like_count", 0),
                 "retweets": metrics.get("retweet_count", 0),
@@ -211,9 +395,63 @@ class XAPIClient:
             raise
 
 
+    async def aget_tweets_bulk_metrics(self, tweet_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Get engagement metrics for many tweets in as few requests as possible
+
+        Uses the multi-ID tweets lookup (up to 100 IDs per request); chunks are
+        fetched concurrently with the shared async HTTP client.
+
+        Args:
+            tweet_ids: X tweet IDs
+
+        Returns:
+            {tweet_id: metrics} in the same shape as get_tweet_analytics();
+            deleted or unavailable tweets are omitted
+        """
+        token = self.access_token or settings.x_bearer_token
+        chunks = [tweet_ids[i:i + 100] for i in range(0, len(tweet_ids), 100)]
+
+        try:
+            responses = await asyncio.gather(*(
+                _x_api_http.get(
+                    "/tweets",
+                    params={"ids": ",".join(chunk), "tweet.fields": "public_metrics,created_at"},
+                    headers={"Authorization": f"Bearer {token}"}
+                )
+                for chunk in chunks
+            ))
+            for response in responses:
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching tweet metrics: {e}")
+            raise
+
+        results = {}
+        for response in responses:
+            for tweet in response.json().get("data", []):
+                metrics = tweet.get("public_metrics", {})
+                results[tweet["id"]] = {
+                    "id": tweet["id"],
+                    "created_at": tweet.get("created_at"),
+                    "likes": metrics.get("like_count", 0),
+                    "retweets": metrics.get("retweet_count", 0),
+                    "replies": metrics.get("reply_count", 0),
+                    "views": metrics.get("impression_count", 0),
+                    "engagement_score": (
+                        metrics.get("like_count", 0) +
+                        metrics.get("retweet_count", 0) +
+                        metrics.get("reply_count", 0)
+                    )
+                }
+
+        return results
+
+
+    @_redis_cached("x:user", ttl=300)
     def get_user_info(self, user_id: str) -> Dict:
         """
-        Get user profile information
+        Get user profile information (cached in Redis for 5 minutes)
 
         Args:
             user_id: X user ID
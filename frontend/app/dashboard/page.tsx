@@ -28,9 +28,8 @@ export default function DashboardPage() {
       setVoiceStatus(voiceData.status as 'pending' | 'complete');
 
       // Load queue count
-      const queueData = await api.getQueue();
-      const pendingCount = queueData.posts.filter((p) => p.status === 'pending').length;
-      setQueueCount(pendingCount);
+      const queueData = await api.getQueue({ status: 'pending', limit: 1 });
+      setQueueCount(queueData.count ?? 0);
     } catch (error: any) {
       console.error('Dashboard load error:', error);
       toast.error('Failed to load dashboard');
@@ -7,6 +7,7 @@ import { useRouter } from 'next/navigation';
 import { Sparkles, Twitter, TrendingUp, Clock, BarChart3 } from 'lucide-react';
 import AuthButton from '@/components/AuthButton';
 import { auth } from '@/lib/auth';
+import { api } from '@/lib/api';
 import toast from 'react-hot-toast';
 
 export default function LandingPage() {
@@ -17,6 +18,7 @@ export default function LandingPage() {
     // Handle OAuth callback from URL
     const params = new URLSearchParams(window.location.search);
     const token = params.get('access_token');
+    const oauthTask = params.get('oauth_task');
     
     if (token) {
       auth.setToken(token);
@@ -25,6 +27,40 @@ export default function LandingPage() {
       return;
     }
 
+    if (oauthTask) {
+      // Login is finished by a background worker; poll until our JWT is ready
+      let cancelled = false;
+
+      const poll = async (attempt: number) => {
+        try {
+          const result = await api.getOAuthStatus(oauthTask);
+          if (cancelled) return;
+
+          if (result.status === 'complete') {
+            auth.setToken(result.access_token);
+            toast.success('Connected successfully!');
+            router.push('/dashboard');
+            return;
+          }
+
+          if (attempt < 30) {
+            setTimeout(() => poll(attempt + 1), 1000);
+            return;
+          }
+        } catch (error) {
+          if (cancelled) return;
+        }
+
+        toast.error('Failed to connect X account');
+        setLoading(false);
+      };
+
+      poll(0);
+      return () => {
+        cancelled = true;
+      };
+    }
+
     // Redirect if already authenticated
     if (auth.isAuthenticated()) {
       router.push('/dashboard');
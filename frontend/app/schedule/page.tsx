@@ -9,7 +9,10 @@ import type { ScheduledPost } from '@/lib/types';
 
 export default function SchedulePage() {
   const [posts, setPosts] = useState<ScheduledPost[]>([]);
+  const [counts, setCounts] = useState<Record<ScheduledPost['status'], number> | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadQueue();
@@ -20,6 +23,8 @@ export default function SchedulePage() {
     try {
       const result = await api.getQueue();
       setPosts(result.posts);
+      setCounts(result.counts);
+      setNextCursor(result.next_cursor);
     } catch (error: any) {
       console.error('Queue load error:', error);
       toast.error('Failed to load queue');
@@ -28,6 +33,22 @@ export default function SchedulePage() {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+
+    setLoadingMore(true);
+    try {
+      const result = await api.getQueue({ cursor: nextCursor });
+      setPosts((prev) => [...prev, ...result.posts]);
+      setNextCursor(result.next_cursor);
+    } catch (error: any) {
+      console.error('Queue load error:', error);
+      toast.error('Failed to load more posts');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDelete = async (id: number) => {
     if (!confirm('Are you sure you want to delete this scheduled post?')) {
       return;
@@ -37,7 +58,11 @@ export default function SchedulePage() {
       await api.deleteScheduledPost(id);
       toast.success('Scheduled post deleted');
       // Remove from local state
+      const deleted = posts.find((p) => p.id === id);
       setPosts((prev) => prev.filter((p) => p.id !== id));
+      if (deleted) {
+        setCounts((prev) => prev && { ...prev, [deleted.status]: prev[deleted.status] - 1 });
+      }
     } catch (error: any) {
       console.error('Delete error:', error);
       toast.error(error.response?.data?.detail || 'Failed to delete post');
@@ -52,11 +77,16 @@ export default function SchedulePage() {
     );
   }
 
-  // Separate posts by status
-  const pending = posts.filter((p) => p.status === 'pending');
+  // Separate posts by status (dispatched = being posted right now, shown with pending)
+  const pending = posts.filter((p) => p.status === 'pending' || p.status === 'dispatched');
   const posted = posts.filter((p) => p.status === 'posted');
   const failed = posts.filter((p) => p.status === 'failed');
 
+  // Totals come from the server; the lists above only hold the pages loaded so far
+  const pendingTotal = counts ? counts.pending + counts.dispatched : pending.length;
+  const postedTotal = counts ? counts.posted : posted.length;
+  const failedTotal = counts ? counts.failed : failed.length;
+
   return (
     <div className="space-y-8">
       {/* Header */}
@@ -71,15 +101,15 @@ export default function SchedulePage() {
       <div className="grid md:grid-cols-3 gap-6">
         <div className="card">
           <p className="text-sm font-medium text-gray-500">Pending</p>
-          <p className="text-3xl font-bold text-yellow-600 mt-2">{pending.length}</p>
+          <p className="text-3xl font-bold text-yellow-600 mt-2">{pendingTotal}</p>
         </div>
         <div className="card">
           <p className="text-sm font-medium text-gray-500">Posted</p>
-          <p className="text-3xl font-bold text-green-600 mt-2">{posted.length}</p>
+          <p className="text-3xl font-bold text-green-600 mt-2">{postedTotal}</p>
         </div>
         <div className="card">
           <p className="text-sm font-medium text-gray-500">Failed</p>
-          <p className="text-3xl font-bold text-red-600 mt-2">{failed.length}</p>
+          <p className="text-3xl font-bold text-red-600 mt-2">{failedTotal}</p>
         </div>
       </div>
 
@@ -107,6 +137,20 @@ export default function SchedulePage() {
         </div>
       )}
 
+      {/* Load More */}
+      {nextCursor && (
+        <div className="text-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="inline-flex items-center gap-2 bg-prism-purple hover:bg-prism-purple/90 disabled:opacity-50 text-white font-semibold px-6 py-3 rounded-lg transition-colors"
+          >
+            {loadingMore && <Loader2 className="w-4 h-4 animate-spin" />}
+            Load more
+          </button>
+        </div>
+      )}
+
       {/* Empty State */}
       {posts.length === 0 && (
         <div className="card text-center py-12">
@@ -28,6 +28,13 @@ export default function QueueList({ posts, onDelete }: QueueListProps) {
             Pending
           </span>
         );
+      case 'dispatched':
+        return (
+          <span className="flex items-center gap-1 px-3 py-1 bg-blue-100 text-blue-700 rounded-full text-sm font-medium">
+            <Clock className="w-4 h-4" />
+            Posting
+          </span>
+        );
       case 'posted':
         return (
           <span className="flex items-center gap-1 px-3 py-1 bg-green-100 text-green-700 rounded-full text-sm font-medium">
@@ -8,6 +8,7 @@ import { auth } from './auth';
 import type {
   User,
   AuthResponse,
+  OAuthStatus,
   ViralPost,
   RemixRequest,
   RemixResponse,
@@ -70,7 +71,18 @@ export const api = {
    * Start X OAuth flow
    */
   async startOAuth(): Promise<{ authorization_url: string; state: string }> {
-    const { data } = await apiClient.get('/api/auth/connect');
+    // Sets the HttpOnly cookie that /api/auth/status checks
+    const { data } = await apiClient.get('/api/auth/connect', { withCredentials: true });
+    return data;
+  },
+
+  /**
+   * Poll the result of the OAuth callback
+   */
+  async getOAuthStatus(taskId: string): Promise<OAuthStatus> {
+    const { data } = await apiClient.get(`/api/auth/status/${taskId}`, {
+      withCredentials: true,
+    });
     return data;
   },
 
@@ -157,11 +169,17 @@ export const api = {
   /**
    * Get scheduled posts queue
    */
-  async getQueue(): Promise<{
-    count: number;
+  async getQueue(params?: {
+    status?: ScheduledPost['status'];
+    limit?: number;
+    cursor?: string;
+  }): Promise<{
+    count: number | null;
+    counts: Record<ScheduledPost['status'], number> | null;
+    next_cursor: string | null;
     posts: ScheduledPost[];
   }> {
-    const { data } = await apiClient.get('/api/schedule/queue');
+    const { data } = await apiClient.get('/api/schedule/queue', { params });
     return data;
   },
 
@@ -184,7 +202,8 @@ export const api = {
    * Get analytics for published posts
    */
   async getAnalytics(): Promise<{
-    count: number;
+    returned: number;
+    total: number | null;
     posts: AnalyticsPost[];
   }> {
     const { data } = await apiClient.get('/api/analytics/posts');
@@ -238,7 +257,7 @@ export const api = {
   /**
    * Get payment history
    */
-  async getPaymentHistory(): Promise<{ count: number; payments: Payment[] }> {
+  async getPaymentHistory(): Promise<{ returned: number; total: number | null; payments: Payment[] }> {
     const { data } = await apiClient.get('/api/billing/history');
     return data;
   },
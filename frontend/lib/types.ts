@@ -31,6 +31,10 @@ export interface AuthResponse {
   };
 }
 
+export type OAuthStatus =
+  | { status: 'pending' }
+  | ({ status: 'complete' } & AuthResponse);
+
 export interface ViralPost {
   id: string;
   text: string;
@@ -61,7 +65,7 @@ export interface ScheduledPost {
   post_id: number;
   content: string;
   scheduled_for: string;
-  status: 'pending' | 'posted' | 'failed';
+  status: 'pending' | 'dispatched' | 'posted' | 'failed';
   posted_at: string | null;
   x_post_id: string | null;
   error_message: string | null;